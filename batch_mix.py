@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+from model.Gallery import Gallery
+from model.Image import Image
+from model.Mixer import Mixer
+
+crop_modes = {"none": 0, "inner": 1, "outer": 2}
+
+
+def read_manifest(manifest_path):
+    """
+    Read mix jobs from a JSON Lines manifest, one job per line.
+
+    Each job has:
+    - images (list): Paths of the four input images.
+    - types (list): Component used from each image ("magnitude"/"phase" or "real"/"imaginary").
+    - weights (list): Weight of each component, from 0 to 1.
+    - crop_mode (str or int, optional): "none", "inner" or "outer" (or 0, 1, 2). Default is "none".
+    - roi (list, optional): x1,x2,y1,y2 on the centered spectrum, required when cropping.
+    - output (str, optional): Output image path, relative to the output directory.
+
+    Parameters:
+    - manifest_path (str): Path of the manifest, or "-" for standard input.
+
+    Yields:
+    - tuple: (line number, job dictionary), or (line number, ValueError) for a line that
+             is not a JSON object, so the other jobs still run.
+    """
+    manifest = sys.stdin if manifest_path == "-" else open(manifest_path)
+    with manifest:
+        for line_number, line in enumerate(manifest, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as error:
+                yield line_number, ValueError(f"Invalid JSON: {error}")
+                continue
+            if not isinstance(job, dict):
+                yield line_number, ValueError("A job must be a JSON object")
+                continue
+            yield line_number, job
+
+
+def run_job(job, output_path, tile_budget_mb=None):
+    """
+    Load the images of a job, mix them and write the result.
+
+    Parameters:
+    - job (dict): The job, as read from the manifest.
+    - output_path (str): Path of the output image.
+    - tile_budget_mb (float, optional): If given, mix out of core within this memory
+                                        budget, in megabytes (see Mixer.inverse_fft_tiled).
+                                        The output is then written to a memory-mapped
+                                        file; decoding and the forward transforms still
+                                        run in memory.
+
+    Returns:
+    - str: The output path.
+    """
+    if len(job["images"]) != 4:
+        raise ValueError("A job needs exactly four images")
+
+    gallery = Gallery()
+    for image_id, image_path in enumerate(job["images"]):
+        image = Image()
+        image.load_img(image_path)
+        gallery.add_image(image, image_id)
+    Image.reshape_all(list(gallery.get_gallery().values()))
+
+    crop_mode = job.get("crop_mode", "none")
+    crop_mode = crop_modes[crop_mode] if isinstance(crop_mode, str) else crop_mode
+    dimensions = [int(coord) for coord in job["roi"]] if crop_mode else None
+
+    mixer = Mixer(job["weights"], job["types"], 0, 1, 2, 3)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    if tile_budget_mb:
+        # The 8-bit output is mapped from a temporary file, band by band, instead of
+        # being held in memory with a full-size float image
+        with tempfile.TemporaryFile() as output_file:
+            output = np.memmap(
+                output_file,
+                dtype=np.uint8,
+                mode="w+",
+                shape=gallery.get_gallery()[0].shape,
+            )
+            mixer.inverse_fft_tiled(
+                gallery, crop_mode, dimensions, budget_mb=tile_budget_mb, output=output
+            )
+            written = cv2.imwrite(output_path, output)
+            del output
+    else:
+        output = mixer.inverse_fft(gallery, crop_mode, dimensions)
+        written = cv2.imwrite(output_path, output.astype(np.uint8))
+
+    if not written:
+        raise OSError(f"Could not write {output_path}")
+    return output_path
+
+
+def run_manifest(
+    manifest_path, output_dir, workers=None, max_in_flight=None, tile_budget_mb=None
+):
+    """
+    Run every job of a manifest on a process pool, writing outputs as jobs finish.
+
+    At most max_in_flight jobs are submitted at a time, so the manifest is streamed
+    instead of being loaded at once.
+
+    Parameters:
+    - manifest_path (str): Path of the manifest, or "-" for standard input.
+    - output_dir (str): Directory for the outputs of jobs without an absolute output path.
+    - workers (int, optional): Number of worker processes. Default is the number of CPUs.
+    - max_in_flight (int, optional): Maximum number of submitted jobs. Default is twice the workers.
+    - tile_budget_mb (float, optional): If given, mix every job out of core within this budget.
+
+    Returns:
+    - int: Number of failed jobs.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    failed = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+
+        def collect(futures):
+            nonlocal failed
+            for future in futures:
+                line_number = in_flight.pop(future)
+                try:
+                    print(f"[{line_number}] {future.result()}", flush=True)
+                except Exception as error:
+                    failed += 1
+                    print(f"[{line_number}] failed: {error}", file=sys.stderr)
+
+        for line_number, job in read_manifest(manifest_path):
+            if isinstance(job, ValueError):
+                failed += 1
+                print(f"[{line_number}] failed: {job}", file=sys.stderr)
+                continue
+            output_path = os.path.join(
+                output_dir, job.get("output", f"mix_{line_number:06d}.png")
+            )
+            in_flight[executor.submit(run_job, job, output_path, tile_budget_mb)] = (
+                line_number
+            )
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        collect(wait(in_flight).done)
+
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mix images from a JSON Lines manifest without the GUI."
+    )
+    parser.add_argument("manifest", help='manifest path, or "-" for standard input')
+    parser.add_argument("-o", "--output-dir", default="output")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    parser.add_argument(
+        "--tile-budget-mb",
+        type=float,
+        default=None,
+        help="mix out of core, keeping each job's working arrays within this budget",
+    )
+    args = parser.parse_args()
+
+    failed = run_manifest(
+        args.manifest,
+        args.output_dir,
+        args.workers,
+        args.max_in_flight,
+        args.tile_budget_mb,
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from model import FFTBackend, Precision, SpectrumStore
+from model.Gallery import Gallery
+from model.Image import Image
+from model.Mixer import Mixer
+from model.SpectrumCache import shared_cache
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+DATA_IMAGES = ["woman.png", "woman2.png", "cat.jpg", "dog.jpg"]
+
+# (height, width) of the synthetic images of each size
+SIZES = {
+    "512": (512, 512),
+    "1k": (1024, 1024),
+    "2k": (2048, 2048),
+    "4k": (2160, 3840),
+    "8k": (4320, 7680),
+}
+
+MODES = {
+    "magnitude_phase": ["magnitude", "phase", "magnitude", "phase"],
+    "real_imaginary": ["real", "imaginary", "real", "imaginary"],
+}
+CROPS = {"none": 0, "inner": 1, "outer": 2}
+WEIGHTS = [0.5, 1, 0.25, 0.75]
+# The same weights with one slider moved, for the incremental mixes
+CHANGED_WEIGHTS = [0.5, 1, 0.4, 0.75]
+
+
+def measure(function, repeat, setup=None):
+    """
+    Time a function, then trace one more call for its memory use.
+
+    Tracing slows every allocation down, so the timed calls run without it.
+
+    Parameters:
+    - function (callable): The code to measure.
+    - repeat (int): Number of timed calls.
+    - setup (callable, optional): Called before every call, outside the measurement.
+
+    Returns:
+    - dict: Median and best time in seconds, peak traced memory in megabytes, and
+            the number of memory blocks allocated by the call and still held at its end.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    base = tracemalloc.get_traced_memory()[0]
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del result
+
+    allocations = sum(
+        max(statistic.count_diff, 0)
+        for statistic in after.compare_to(before, "filename")
+    )
+    return {
+        "seconds": statistics.median(times),
+        "best": min(times),
+        "peak_mb": (peak - base) / 2**20,
+        "allocations": allocations,
+    }
+
+
+def write_synthetic_images(directory, name, shape, count=4):
+    """
+    Write deterministic synthetic test images of about the given shape.
+
+    Each image is a few pixels larger than the previous one, so reshape_all has to
+    resize them to the smallest one.
+
+    Parameters:
+    - directory (str): Directory the images are written to.
+    - name (str): Name of the size, used in the file names.
+    - shape (tuple): (height, width) of the smallest image.
+    - count (int, optional): Number of images. Default is 4.
+
+    Returns:
+    - list: Paths of the images.
+    """
+    paths = []
+    for index in range(count):
+        height, width = shape[0] + 16 * index, shape[1] + 16 * index
+        rows, columns = np.mgrid[0:height, 0:width].astype(np.float32)
+        generator = np.random.default_rng(index)
+        image = (
+            96
+            + 64 * np.sin(rows / (13 + 7 * index)) * np.cos(columns / (17 + 5 * index))
+            + 48 * ((rows // 64 + columns // 64 + index) % 2)
+            + generator.normal(0, 12, (height, width))
+        )
+        path = os.path.join(directory, f"{name}_{index}.png")
+        cv2.imwrite(path, np.clip(image, 0, 255).astype(np.uint8))
+        paths.append(path)
+    return paths
+
+
+def benchmark_case(name, paths, repeat):
+    """
+    Benchmark every pipeline stage on one set of four images.
+
+    Parameters:
+    - name (str): Name of the case.
+    - paths (list): Paths of the four images.
+    - repeat (int): Number of timed calls of each stage.
+
+    Returns:
+    - list: One result dictionary per stage.
+    """
+    results = []
+
+    def record(stage, pixels, measurement, **details):
+        measurement["megapixels_per_second"] = (
+            pixels / 1e6 / measurement["seconds"] if measurement["seconds"] else None
+        )
+        results.append(
+            {
+                "name": "/".join([name, stage] + list(details.values())),
+                "case": name,
+                "stage": stage,
+                "shape": list(shape),
+                **details,
+                **measurement,
+            }
+        )
+        print(
+            f"{results[-1]['name']:<48} {measurement['seconds'] * 1e3:10.2f} ms"
+            f" {measurement['peak_mb']:10.1f} MB"
+            f" {measurement['allocations']:8d} blocks",
+            flush=True,
+        )
+
+    images = [Image() for _ in paths]
+
+    def load_all():
+        for image, path in zip(images, paths):
+            image.load_img(path)
+
+    measurement = measure(load_all, repeat)
+    load_pixels = sum(image.original_image.size for image in images)
+    shape = images[0].original_image.shape
+    record("load_img", load_pixels, measurement)
+
+    def restore_originals():
+        shared_cache.clear()
+        for image in images:
+            image.image = image.original_image
+            image.shape = image.original_image.shape
+            image.fft = None
+            image.clear_cache()
+
+    measurement = measure(lambda: Image.reshape_all(images), repeat, restore_originals)
+    shape = images[0].shape
+    pixels = sum(image.image.size for image in images)
+    record("reshape_all", pixels, measurement)
+
+    def transform_all():
+        for image in images:
+            image.compute_fourier_transform()
+
+    measurement = measure(transform_all, repeat, shared_cache.clear)
+    record("compute_fourier_transform", pixels, measurement)
+
+    def clear_components():
+        for image in images:
+            image.clear_cache()
+
+    # The log of negative real and imaginary parts is NaN, which the views show as black
+    @np.errstate(invalid="ignore")
+    def display_all():
+        for image in images:
+            image.get_magnitude()
+            image.get_phase()
+            image.get_real()
+            image.get_imaginary()
+
+    measurement = measure(display_all, repeat, clear_components)
+    record("display", pixels, measurement)
+
+    gallery = Gallery()
+    for image_id, image in enumerate(images):
+        gallery.add_image(image, image_id)
+
+    height, width = shape
+    roi = [width // 4, 3 * width // 4, height // 4, 3 * height // 4]
+    for mode, types in MODES.items():
+        mixer = Mixer(WEIGHTS, types, 0, 1, 2, 3)
+
+        def reset_stack():
+            gallery.stack = None
+
+        def fresh_stack():
+            # A new stack has no component sums or outputs remembered from earlier mixes
+            reset_stack()
+            gallery.get_stack()
+
+        # First mix after loading, which also builds the component stacks
+        measurement = measure(lambda: mixer.inverse_fft(gallery), repeat, reset_stack)
+        record("inverse_fft_cold", height * width, measurement, mode=mode)
+
+        for crop, crop_mode in CROPS.items():
+            mixer.weights = WEIGHTS
+            measurement = measure(
+                lambda: mixer.inverse_fft(gallery, crop_mode, roi), repeat, fresh_stack
+            )
+            record("inverse_fft", height * width, measurement, mode=mode, crop=crop)
+
+            def mix_then_change_weight():
+                # The measured mix only differs from the previous one by one weight
+                mixer.weights = WEIGHTS
+                mixer.inverse_fft(gallery, crop_mode, roi)
+                mixer.weights = CHANGED_WEIGHTS
+
+            measurement = measure(
+                lambda: mixer.inverse_fft(gallery, crop_mode, roi),
+                repeat,
+                mix_then_change_weight,
+            )
+            record(
+                "inverse_fft_incremental",
+                height * width,
+                measurement,
+                mode=mode,
+                crop=crop,
+            )
+            mixer.weights = WEIGHTS
+
+    return results
+
+
+def run(sizes, repeat, use_data=True):
+    """
+    Run the benchmark on the bundled images and on synthetic images of each size.
+
+    Parameters:
+    - sizes (list): Names of the synthetic sizes, keys of SIZES.
+    - repeat (int): Number of timed calls of each stage.
+    - use_data (bool, optional): Whether to benchmark the bundled images. Default is True.
+
+    Returns:
+    - dict: The run metadata and the results.
+    """
+    # Every transform must be computed, not read from the on-disk store
+    SpectrumStore.set_store(None)
+    backend = FFTBackend.get_backend()
+    report = {
+        "metadata": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "precision": Precision.get_precision(),
+            "fft_backend": backend.name,
+            "fft_workers": backend.workers,
+            "repeat": repeat,
+        },
+        "results": [],
+    }
+
+    if use_data:
+        paths = [os.path.join(DATA_DIR, name) for name in DATA_IMAGES]
+        report["results"] += benchmark_case("data", paths, repeat)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            paths = write_synthetic_images(directory, size, SIZES[size])
+            report["results"] += benchmark_case(size, paths, repeat)
+            shared_cache.clear()
+            gc.collect()
+
+    return report
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compare the median times of two runs, stage by stage.
+
+    Parameters:
+    - baseline (dict): The reference run.
+    - current (dict): The run to check.
+    - threshold (float, optional): Relative slowdown reported as a regression. Default is 0.1.
+
+    Returns:
+    - int: Number of regressions.
+    """
+    baseline_results = {result["name"]: result for result in baseline["results"]}
+    regressions = 0
+    print(f"{'stage':<48} {'baseline':>12} {'current':>12} {'ratio':>7}  peak MB")
+    for result in current["results"]:
+        reference = baseline_results.get(result["name"])
+        if reference is None:
+            continue
+
+        ratio = result["seconds"] / reference["seconds"]
+        if ratio > 1 + threshold:
+            verdict = "regression"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            verdict = "improved"
+        else:
+            verdict = ""
+        print(
+            f"{result['name']:<48}"
+            f" {reference['seconds'] * 1e3:9.2f} ms {result['seconds'] * 1e3:9.2f} ms"
+            f" {ratio:7.2f}  {reference['peak_mb']:.1f} -> {result['peak_mb']:.1f}"
+            f"  {verdict}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark loading, transforming, resizing, displaying and mixing images."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmark")
+    run_parser.add_argument("-o", "--output", default="benchmark.json")
+    run_parser.add_argument(
+        "--sizes",
+        default=",".join(SIZES),
+        help=f"comma-separated synthetic sizes among {', '.join(SIZES)}",
+    )
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument(
+        "--no-data", action="store_true", help="skip the bundled images"
+    )
+
+    compare_parser = commands.add_parser("compare", help="compare two runs")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        sizes = [size for size in args.sizes.split(",") if size]
+        for size in sizes:
+            if size not in SIZES:
+                parser.error(f"unknown size: {size}")
+        report = run(sizes, args.repeat, not args.no_data)
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        with open(args.baseline) as baseline_file, open(args.current) as current_file:
+            regressions = compare(json.load(baseline_file), json.load(current_file))
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Startup target, from launching the interpreter to the shown main window
+TARGET_MS = 400
+
+# Run in a fresh interpreter: imports main, then shows the window and reports the time
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+from PyQt6.QtWidgets import QApplication
+import main
+app = QApplication([])
+window = main.MainWindow()
+window.show()
+app.processEvents()
+print((time.perf_counter() - start) * 1e3)
+window.close()
+"""
+
+
+def measure_startup(runs):
+    """
+    Launch the application several times in fresh interpreters and time its startup.
+
+    Parameters:
+    - runs (int): Number of launches.
+
+    Returns:
+    - tuple: (times in milliseconds from the first import to the shown window,
+              times in milliseconds of the whole process, including the interpreter).
+    """
+    environment = dict(os.environ)
+    environment.setdefault("QT_QPA_PLATFORM", "offscreen")
+    environment["PYTHONPATH"] = ROOT_DIR
+
+    window_times, process_times = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT],
+            cwd=ROOT_DIR,
+            env=environment,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        process_times.append((time.perf_counter() - start) * 1e3)
+        window_times.append(float(completed.stdout.split()[-1]))
+    return window_times, process_times
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the time from launching the application to its shown window."
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=TARGET_MS)
+    args = parser.parse_args()
+
+    window_times, process_times = measure_startup(args.runs)
+    process_median = statistics.median(process_times)
+    print(f"imports to shown window: {statistics.median(window_times):.0f} ms")
+    print(f"process launch to exit:  {process_median:.0f} ms")
+    print(f"target:                  {args.target_ms:.0f} ms")
+    sys.exit(0 if process_median <= args.target_ms else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,36 @@
-import random
+import os
+import threading
 from PyQt6 import QtCore
-from PyQt6.QtCore import QTimer, QRectF
+from PyQt6.QtCore import QTimer, QRectF, pyqtSignal
+from PyQt6.QtGui import QKeySequence, QShortcut
 from PyQt6.QtWidgets import (
     QApplication,
     QMainWindow,
     QFileDialog,
     QHBoxLayout,
+    QCheckBox,
 )
-import pyqtgraph as pg
 
 from view.mainwindow import Ui_MainWindow
+from model import FFTBackend, Instrumentation
 from model.Gallery import Gallery
 from model.Image import Image
 from model.ImageProcessingThread import ImageProcessingThread
-from view.CustomImageView import CustomImageView
+from model.Mixer import Mixer
 
 modes = ["Real", "Imaginary", "Magnitude", "Phase"]
 
+# Number of worker processes for full-resolution mixes, 0 mixes on a thread
+WORKER_PROCESSES = int(os.environ.get("IMAGE_MIXER_WORKER_PROCESSES", 0))
+
+# Largest side of the live preview, and idle time before the full-resolution mix
+PREVIEW_SIZE = 256
+PREVIEW_IDLE_MS = 400
+
 
 class MainWindow(QMainWindow, Ui_MainWindow):
     image = None
+    imageLoaded = pyqtSignal(int, object)
 
     def __init__(self):
         super().__init__()
@@ -30,6 +41,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.freqViewWidgets = [None, None, None, None]
         self.rois = [None, None, None, None]
         self.imagePaths = ["", "", "", ""]
+        self.pendingLoads = [None, None, None, None]
+        self.imageLoaded.connect(self.handleImageLoaded)
         self.componentsIds = [0, 0, 0, 0]
 
         self.imageWidgets = [
@@ -83,6 +96,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         self.currentOutput = 0
         self.outputWidgets = [self.outputOneWidget, self.outputTwoWidget]
+        self.outputViews = [None, None]
         for i, widget in enumerate(self.outputWidgets):
             layout = QHBoxLayout()
             widget.setLayout(layout)
@@ -119,85 +133,153 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         self.convertButton.clicked.connect(self.handleConvert)
 
+        self.livePreviewCheckbox = QCheckBox("Live preview", parent=self.controlFrame)
+        self.horizontalLayout_2.insertWidget(
+            self.horizontalLayout_2.indexOf(self.convertButton),
+            self.livePreviewCheckbox,
+        )
+        self.livePreviewCheckbox.toggled.connect(self.handleToggleLivePreview)
+        self.previewIdleTimer = QTimer()
+        self.previewIdleTimer.setSingleShot(True)
+        self.previewIdleTimer.setInterval(PREVIEW_IDLE_MS)
+        self.previewIdleTimer.timeout.connect(self.handleConvert)
+        self.previewPending = False
+
         self.progressBar.setVisible(False)
         self.stopButton.setVisible(False)
         self.stopButton.clicked.connect(self.cancelProgressBar)
-        self.stopped = False
+        self.stopped = [False] * len(self.outputWidgets)
+        self.progressOutput = 0
+        self.progressHideTimer = QTimer()
+        self.progressHideTimer.setSingleShot(True)
+        self.progressHideTimer.setInterval(2000)
+        self.progressHideTimer.timeout.connect(self.hideProgressbar)
+
+        # One persistent worker per output channel, so the mixes of both channels run
+        # at the same time, optionally in worker processes
+        self.pool = None
+        if WORKER_PROCESSES:
+            from model.SharedSpectrumPool import SharedSpectrumPool
+
+            self.pool = SharedSpectrumPool(WORKER_PROCESSES)
+        self.processingThreads = []
+        for channel in range(len(self.outputWidgets)):
+            processingThread = ImageProcessingThread(self.gallery, self.pool)
+            processingThread.processingDone.connect(
+                lambda output, channel=channel: self.showImage(output, channel)
+            )
+            processingThread.processingFailed.connect(self.showMixError)
+            processingThread.progressChanged.connect(
+                lambda value, channel=channel: self.showProgress(value, channel)
+            )
+            processingThread.start()
+            self.processingThreads.append(processingThread)
+
+        # Per-stage timings in the status bar, and Ctrl+Shift+T exports a Chrome trace
+        if Instrumentation.is_enabled():
+            self.statusBar().showMessage("Instrumentation enabled")
+            self.exportTraceShortcut = QShortcut(QKeySequence("Ctrl+Shift+T"), self)
+            self.exportTraceShortcut.activated.connect(self.handleExportTrace)
 
     def handleUploadImage(self, event, index):
         if event.button() == QtCore.Qt.MouseButton.LeftButton:
             self.handleBrowseImage(index)
 
     def handleBrowseImage(self, index):
-        img = QFileDialog.getOpenFileName(
-            self, "Open file", ".\\", "Image files (*.jpg *.png)"
+        # Several files fill the following slots, and load concurrently
+        paths, _ = QFileDialog.getOpenFileNames(
+            self, "Open files", ".\\", "Image files (*.jpg *.png)"
         )
-        if img:
-            image = Image()
-            image.load_img(img[0])
-            image.compute_fourier_transform()
-            self.imageModesCombobox[index].setEnabled(True)
-            self.imageModesCombobox[index].setCurrentIndex(
-                0 if self.mixerModeSelect.currentIndex() == 0 else 2
+        paths = paths[: len(self.imageWidgets)]
+        ids = [
+            (index + offset) % len(self.imageWidgets) for offset in range(len(paths))
+        ]
+        for image_id, future in zip(ids, self.gallery.load_many(paths, ids)):
+            self.pendingLoads[image_id] = future
+            future.add_done_callback(
+                lambda future, image_id=image_id: self.imageLoaded.emit(
+                    image_id, future
+                )
             )
-            self.gallery.add_image(image, index)
-
-            Image.reshape_all(self.gallery.get_gallery().values())
-            current_images = self.gallery.get_gallery()
-            self.componentsIds[index] = index
-            self.componentSliders[index].setEnabled(True)
-            for i in current_images:
-                if self.viewWidgets[i] == None:
-                    newGraph = CustomImageView(parent=self.imageWidgets[i])
-                    self.viewWidgets[i] = newGraph
-                    self.imageWidgets[i].layout().addWidget(self.viewWidgets[i])
-                    self.viewWidgets[i].ui.roiBtn.hide()
-                    self.viewWidgets[i].ui.menuBtn.hide()
-                    self.viewWidgets[i].ui.histogram.hide()
-
-                self.viewWidgets[i].setImage(current_images[i].get_image())
-
-                if self.freqViewWidgets[i] == None:
-                    realGraph = pg.ImageView()
-                    self.freqViewWidgets[i] = realGraph
-                    self.transWidgets[i].layout().addWidget(self.freqViewWidgets[i])
-                    self.freqViewWidgets[i].ui.roiBtn.hide()
-                    self.freqViewWidgets[i].ui.menuBtn.hide()
-                    self.freqViewWidgets[i].ui.histogram.hide()
-                    self.freqViewWidgets[i].getView().setMouseEnabled(x=False, y=False)
-
-                currentMode = self.componentsTypes[i]
-                if currentMode == "magnitude":
-                    self.freqViewWidgets[i].setImage(current_images[i].get_magnitude())
-                elif currentMode == "phase":
-                    self.freqViewWidgets[i].setImage(current_images[i].get_phase())
-                elif currentMode == "real":
-                    self.freqViewWidgets[i].setImage(current_images[i].get_real())
-                elif currentMode == "imaginary":
-                    self.freqViewWidgets[i].setImage(current_images[i].get_imaginary())
-
-                if self.rois[i] == None:
-                    ROI_Maxbounds = QRectF(0, 0, 100, 100)
-                    ROI_Maxbounds.adjust(
-                        0,
-                        0,
-                        self.freqViewWidgets[i].getImageItem().width() - 100,
-                        self.freqViewWidgets[i].getImageItem().height() - 100,
-                    )
-                    roi = pg.ROI(
-                        pos=self.currentState["pos"],
-                        size=self.currentState["size"],
-                        hoverPen="b",
-                        resizable=True,
-                        invertible=True,
-                        rotatable=False,
-                        maxBounds=ROI_Maxbounds,
-                    )
-                    if self.cropMode == 0:
-                        roi.hide()
-                    self.rois[i] = roi
-                    roi.sigRegionChangeFinished.connect(lambda: self.modify_regions(i))
-                    self.freqViewWidgets[i].getView().addItem(roi)
+
+    def handleImageLoaded(self, index, future):
+        # Ignore loads replaced by a newer one for the same slot
+        if future is not self.pendingLoads[index]:
+            return
+        self.pendingLoads[index] = None
+        if future.exception() is not None:
+            self.statusBar().showMessage(f"Could not load image: {future.exception()}")
+            return
+
+        # pyqtgraph and the views are imported when the first image is shown
+        import pyqtgraph as pg
+        from view.CustomImageView import CustomImageView
+        from view.PyramidImageView import PyramidImageView
+
+        image = future.result()
+        self.imageModesCombobox[index].setEnabled(True)
+        self.imageModesCombobox[index].setCurrentIndex(
+            0 if self.mixerModeSelect.currentIndex() == 0 else 2
+        )
+        self.gallery.add_image(image, index)
+
+        # The batch was resized to a common size with the other slots; the images
+        # loaded so far already have it, so only the other slots are updated once
+        Image.reshape_all(self.gallery.get_gallery().values(), image.shape)
+        self.gallery.precompute_inverses()
+        if self.pool is not None:
+            # Spectra are copied to shared memory once, not by the first mix
+            self.pool.publish(self.gallery)
+        current_images = self.gallery.get_gallery()
+        self.componentsIds[index] = index
+        self.componentSliders[index].setEnabled(True)
+        for i in current_images:
+            if self.viewWidgets[i] == None:
+                newGraph = CustomImageView(parent=self.imageWidgets[i])
+                self.viewWidgets[i] = newGraph
+                self.imageWidgets[i].layout().addWidget(self.viewWidgets[i])
+                self.viewWidgets[i].ui.roiBtn.hide()
+                self.viewWidgets[i].ui.menuBtn.hide()
+                self.viewWidgets[i].ui.histogram.hide()
+
+            self.viewWidgets[i].setPyramid(current_images[i].get_pyramid("image"))
+
+            if self.freqViewWidgets[i] == None:
+                realGraph = PyramidImageView()
+                self.freqViewWidgets[i] = realGraph
+                self.transWidgets[i].layout().addWidget(self.freqViewWidgets[i])
+                self.freqViewWidgets[i].ui.roiBtn.hide()
+                self.freqViewWidgets[i].ui.menuBtn.hide()
+                self.freqViewWidgets[i].ui.histogram.hide()
+                self.freqViewWidgets[i].getView().setMouseEnabled(x=False, y=False)
+
+            self.freqViewWidgets[i].setPyramid(
+                current_images[i].get_pyramid(self.componentsTypes[i])
+            )
+
+            if self.rois[i] == None:
+                ROI_Maxbounds = QRectF(0, 0, 100, 100)
+                ROI_Maxbounds.adjust(
+                    0,
+                    0,
+                    self.freqViewWidgets[i].getFullRect().width() - 100,
+                    self.freqViewWidgets[i].getFullRect().height() - 100,
+                )
+                roi = pg.ROI(
+                    pos=self.currentState["pos"],
+                    size=self.currentState["size"],
+                    hoverPen="b",
+                    resizable=True,
+                    invertible=True,
+                    rotatable=False,
+                    maxBounds=ROI_Maxbounds,
+                )
+                if self.cropMode == 0:
+                    roi.hide()
+                self.rois[i] = roi
+                roi.sigRegionChangeFinished.connect(lambda: self.modify_regions(i))
+                roi.sigRegionChanged.connect(lambda roi: self.handleDragRegion(roi))
+                self.freqViewWidgets[i].getView().addItem(roi)
 
     def sumSlidersValues(self):
         return sum(self.sliderValues)
@@ -209,6 +291,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             if roi:
                 roi.setState(newState, update=False)
                 roi.stateChanged(finish=False)
+        self.requestPreview()
+
+    def handleDragRegion(self, roi):
+        self.currentState = roi.getState()
+        self.requestPreview()
 
     def handleChangeWeightValue(self, value, index):
         self.sliderValues[index] = value
@@ -221,6 +308,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             ]
         else:
             self.outputSliderValues = [(value / 100) for value in self.sliderValues]
+        self.requestPreview()
 
     def handleChangeOutputChannel(self, index):
         self.currentOutput = index
@@ -232,17 +320,10 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         mode = modes[index]
         image = self.gallery.get_gallery()[i]
 
-        graph = self.freqViewWidgets[i]
-        if mode == "Magnitude":
-            graph.setImage(image.get_magnitude())
-        elif mode == "Phase":
-            graph.setImage(image.get_phase())
-        elif mode == "Real":
-            graph.setImage(image.get_real())
-        elif mode == "Imaginary":
-            graph.setImage(image.get_imaginary())
+        self.freqViewWidgets[i].setPyramid(image.get_pyramid(mode.lower()))
 
         self.componentsTypes[i] = mode.lower()
+        self.requestPreview()
 
     def handleChangeMixerMode(self, index):
         if index == 0:
@@ -277,78 +358,139 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                     roi.hide()
                 else:
                     roi.show()
+        self.requestPreview()
+
+    def handleToggleLivePreview(self, checked):
+        if checked:
+            self.requestPreview()
+        else:
+            self.previewIdleTimer.stop()
+
+    def requestPreview(self):
+        # Coalesce the changes of one event loop turn into a single preview
+        if not self.livePreviewCheckbox.isChecked() or self.previewPending:
+            return
+        self.previewPending = True
+        QTimer.singleShot(0, self.showPreview)
+
+    def showPreview(self):
+        # Remix a low-resolution preview right away, and the full-resolution
+        # output once the input has been idle for PREVIEW_IDLE_MS
+        self.previewPending = False
+        images = self.gallery.get_gallery()
+        if not all(image_id in images for image_id in self.componentsIds):
+            return
+
+        mixer = Mixer(
+            self.outputSliderValues, self.componentsTypes, *self.componentsIds
+        )
+        try:
+            with Instrumentation.stage("preview"):
+                output = mixer.inverse_fft(
+                    self.gallery,
+                    self.cropMode,
+                    Mixer.roi_dimensions(self.currentState),
+                    preview_size=PREVIEW_SIZE,
+                )
+        except ValueError:
+            # Component types are being switched between mixer modes
+            return
+        # The preview is stretched over the full-resolution output it stands for
+        self.showOutput(output, images[self.componentsIds[0]].shape)
+        self.showTimings("preview")
+        self.previewIdleTimer.start()
 
     def handleConvert(self):
         # Show progress bar
+        self.progressHideTimer.stop()
         self.progressBar.setVisible(True)
         self.stopButton.setVisible(True)
         self.progressBar.setValue(0)
 
-        # Start a QTimer to periodically update the progress bar value
-        self.progressTimer = QTimer()
-        self.progressTimer.timeout.connect(self.updateProgressBar)
-        self.progressTimer.start(100)  # update every 100 ms
-
-        # Start image processing in a separate thread
-        self.stopped = False
-        self.thread = ImageProcessingThread(
+        # Queue the mix on the worker of the output channel, replacing any mix still
+        # pending there; the other channel keeps mixing
+        self.stopped[self.currentOutput] = False
+        self.progressOutput = self.currentOutput
+        self.processingThreads[self.currentOutput].submit(
             self.outputSliderValues,
             self.componentsIds,
             self.componentsTypes,
-            self.gallery,
             self.cropMode,
             self.currentState,
         )
-        self.thread.processingDone.connect(self.delayShowImage)
-        self.thread.start()
 
-    def updateProgressBar(self):
-        value = self.progressBar.value()
-        if value < 99:
-            self.progressBar.setValue(value + random.randint(3, 6))
-        else:
-            self.progressTimer.stop()
-
-    def delayShowImage(self, output):
-        QTimer.singleShot(2000, lambda: self.showImage(output))
-
-    def showImage(self, output):
-        if not self.stopped:
-            outputWidget = self.outputWidgets[self.currentOutput]
-            layout = outputWidget.layout()
-            while layout.count():
-                child = layout.takeAt(0)
-                if child.widget():
-                    child.widget().deleteLater()
-
-            outputImage = pg.image(output)
-            outputImage.ui.roiBtn.hide()
-            outputImage.ui.menuBtn.hide()
-            outputImage.ui.histogram.hide()
-            outputWidget.layout().addWidget(outputImage)
-
-        # Hide progress bar
-        self.progressTimer.stop()
-        self.progressBar.setValue(100)
-        QTimer.singleShot(2000, self.hideProgressbar)
+    def showOutput(self, output, fullShape=None, channel=None):
+        if channel is None:
+            channel = self.currentOutput
+        with Instrumentation.stage("display", shape=output.shape):
+            if self.outputViews[channel] is None:
+                from view.OutputView import OutputView
+
+                self.outputViews[channel] = OutputView(self.outputWidgets[channel])
+            self.outputViews[channel].show(output, fullShape)
+
+    def showTimings(self, *stages):
+        if Instrumentation.is_enabled():
+            self.statusBar().showMessage(Instrumentation.summarize(*stages, "display"))
+
+    def handleExportTrace(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export Chrome Trace", "trace.json", "Trace (*.json)"
+        )
+        if path:
+            count = Instrumentation.export_chrome_trace(path)
+            self.statusBar().showMessage(f"Exported {count} stages to {path}")
+
+    def showImage(self, output, channel):
+        if not self.stopped[channel]:
+            self.showOutput(output, channel=channel)
+            self.showTimings("mix")
+
+        # The progress bar follows the last submitted mix
+        if channel == self.progressOutput:
+            self.progressBar.setValue(100)
+            self.progressHideTimer.start()
+
+    def showProgress(self, value, channel):
+        if channel == self.progressOutput:
+            self.progressBar.setValue(value)
+
+    def showMixError(self, message):
+        self.statusBar().showMessage(message)
+        self.progressHideTimer.stop()
+        self.hideProgressbar()
 
     def hideProgressbar(self):
         self.progressBar.setVisible(False)
         self.stopButton.setVisible(False)
 
     def cancelProgressBar(self):
-        # Terminate the thread if progress bar is cancelled
-        if self.thread.isRunning():
-            self.thread.terminate()
-        self.progressTimer.stop()
-        self.stopped = True
+        # The workers stop their running mixes at their next stage
+        for channel, processingThread in enumerate(self.processingThreads):
+            processingThread.cancel()
+            self.stopped[channel] = True
         self.hideProgressbar()
 
+    def closeEvent(self, event):
+        for processingThread in self.processingThreads:
+            processingThread.stop()
+        if self.pool is not None:
+            self.pool.close()
+        super().closeEvent(event)
+
+
+def preloadModules():
+    # Import what loading an image needs while the window waits for the first one
+    import cv2
+
+    FFTBackend.get_backend()
+
 
 def main():
     app = QApplication([])
     window = MainWindow()
     window.show()
+    threading.Thread(target=preloadModules, daemon=True).start()
     app.exec()
 
 
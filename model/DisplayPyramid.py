@@ -0,0 +1,71 @@
+"""
+Multi-resolution display pyramids of images and spectrum components.
+
+Level 0 is the full-resolution array and every next level halves both sides, until the
+largest side is at most MIN_SIZE. A view shows the level matching its on-screen size, so
+redraws cost time proportional to the screen size instead of the image size.
+"""
+
+import numpy as np
+
+# Levels are added until the largest side is at most this many pixels
+MIN_SIZE = 256
+
+
+def downsample(array):
+    """
+    Halve both sides of an array by averaging blocks of 2x2 pixels.
+
+    NaN pixels, such as the log of negative spectrum values, are left out of the
+    averages, so a block is only NaN when all its pixels are.
+
+    Parameters:
+    - array (numpy.ndarray): 2D array of at least 2x2 pixels.
+
+    Returns:
+    - numpy.ndarray: Array of shape (height // 2, width // 2).
+    """
+    height, width = array.shape[0] // 2, array.shape[1] // 2
+    blocks = array[: 2 * height, : 2 * width].reshape(height, 2, width, 2)
+    if array.dtype.kind != "f":
+        return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+    valid = ~np.isnan(blocks)
+    if valid.all():
+        return blocks.mean(axis=(1, 3))
+    total = np.where(valid, blocks, 0).sum(axis=(1, 3))
+    with np.errstate(invalid="ignore"):
+        return total / valid.sum(axis=(1, 3))
+
+
+def build(array, min_size=MIN_SIZE):
+    """
+    Build the display pyramid of an array.
+
+    Parameters:
+    - array (numpy.ndarray): The full-resolution 2D array.
+    - min_size (int, optional): Largest side of the smallest level. Default is MIN_SIZE.
+
+    Returns:
+    - list: The levels, from the full-resolution array to the smallest one.
+    """
+    levels = [array]
+    while max(levels[-1].shape) > min_size and min(levels[-1].shape) >= 2:
+        levels.append(downsample(levels[-1]))
+    return levels
+
+
+def select_level(levels, scale):
+    """
+    Choose the level to show at a given zoom.
+
+    Parameters:
+    - levels (list): The levels of a pyramid.
+    - scale (float): Full-resolution pixels per screen pixel.
+
+    Returns:
+    - int: Index of the smallest level with at least one pixel per screen pixel.
+    """
+    if scale <= 1:
+        return 0
+    return min(int(np.log2(scale)), len(levels) - 1)
@@ -0,0 +1,237 @@
+import importlib
+import importlib.util
+import os
+import threading
+import warnings
+
+import numpy as np
+
+# NumPy 2.0 added out= to its transforms
+NUMPY_FFT_OUT = np.lib.NumpyVersion(np.__version__) >= "2.0.0"
+
+
+def is_installed(module_name):
+    # Checked without importing, the FFT libraries are only imported with their backend
+    return importlib.util.find_spec(module_name) is not None
+
+
+def write_to(result, out):
+    # Backends that cannot transform into a given array copy their result into it
+    if out is None:
+        return result
+    out[...] = result
+    return out
+
+
+class NumpyBackend:
+    name = "numpy"
+
+    def __init__(self, workers=None):
+        """
+        Initialize the NumPy FFT backend.
+
+        NumPy transforms are single-threaded, so workers is ignored. NumPy before 2.0
+        always computes in double precision, so single-precision results are cast back.
+
+        Parameters:
+        - workers (int, optional): Ignored.
+        """
+        self.workers = 1
+
+    def rfft2(self, image, out=None):
+        if (
+            out is not None
+            and NUMPY_FFT_OUT
+            and out.dtype == np.result_type(image.dtype, np.complex64)
+        ):
+            return np.fft.rfft2(image, out=out)
+        return write_to(
+            np.fft.rfft2(image).astype(
+                np.result_type(image.dtype, np.complex64), copy=False
+            ),
+            out,
+        )
+
+    def irfft2(self, half_spectrum, shape, out=None):
+        # NumPy's irfft2 does not write the whole image to out, so it is copied
+        return write_to(
+            np.fft.irfft2(half_spectrum, s=shape).astype(
+                np.finfo(half_spectrum.dtype).dtype, copy=False
+            ),
+            out,
+        )
+
+    def ifft(self, spectrum, axis):
+        return np.fft.ifft(spectrum, axis=axis).astype(spectrum.dtype, copy=False)
+
+    def irfft(self, half_spectrum, length):
+        return np.fft.irfft(half_spectrum, n=length).astype(
+            np.finfo(half_spectrum.dtype).dtype, copy=False
+        )
+
+
+class ScipyBackend:
+    name = "scipy"
+
+    def __init__(self, workers=None):
+        """
+        Initialize the scipy.fft backend, which transforms float32 natively and splits
+        each transform over several threads.
+
+        Parameters:
+        - workers (int, optional): Number of threads per transform. Default is the number of CPUs.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.fft = importlib.import_module("scipy.fft")
+
+    def rfft2(self, image, out=None):
+        return write_to(self.fft.rfft2(image, workers=self.workers), out)
+
+    def irfft2(self, half_spectrum, shape, out=None):
+        return write_to(
+            self.fft.irfft2(half_spectrum, s=shape, workers=self.workers), out
+        )
+
+    def ifft(self, spectrum, axis):
+        return self.fft.ifft(spectrum, axis=axis, workers=self.workers)
+
+    def irfft(self, half_spectrum, length):
+        return self.fft.irfft(half_spectrum, n=length, workers=self.workers)
+
+
+class PlannedBackend:
+    name = "planned"
+
+    def __init__(self, workers=None):
+        """
+        Initialize the pyFFTW backend, which plans each transform once per (shape, dtype)
+        and reuses the plan for every later transform of the same shape.
+
+        Parameters:
+        - workers (int, optional): Number of threads per transform. Default is the number of CPUs.
+
+        Attributes:
+        - plans (dict): Plans keyed by (kind, input shape, input dtype, options).
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.pyfftw = importlib.import_module("pyfftw")
+        self.builders = importlib.import_module("pyfftw.builders")
+        self.plans = {}
+        self.lock = threading.Lock()
+
+    def get_plan(self, kind, array, **options):
+        key = (kind, array.shape, array.dtype.str, tuple(sorted(options.items())))
+        with self.lock:
+            if key not in self.plans:
+                template = self.pyfftw.empty_aligned(array.shape, dtype=array.dtype)
+                builder = getattr(self.builders, kind)
+                plan = builder(template, threads=self.workers, **options)
+                # A plan owns its buffers, so it can only run one transform at a time
+                self.plans[key] = (plan, threading.Lock())
+            return self.plans[key]
+
+    def execute(self, plan, lock, array, out=None):
+        # Copy into the plan's own input buffer, a c2r transform overwrites its input
+        with lock:
+            plan.input_array[...] = array
+            plan()
+            if out is None:
+                return plan.output_array.copy()
+            out[...] = plan.output_array
+            return out
+
+    def rfft2(self, image, out=None):
+        return self.execute(*self.get_plan("rfft2", image), image, out)
+
+    def irfft2(self, half_spectrum, shape, out=None):
+        return self.execute(
+            *self.get_plan("irfft2", half_spectrum, s=tuple(shape)), half_spectrum, out
+        )
+
+    def ifft(self, spectrum, axis):
+        return self.execute(*self.get_plan("ifft", spectrum, axis=axis), spectrum)
+
+    def irfft(self, half_spectrum, length):
+        return self.execute(
+            *self.get_plan("irfft", half_spectrum, n=length), half_spectrum
+        )
+
+
+BACKENDS = {
+    NumpyBackend.name: NumpyBackend,
+    ScipyBackend.name: ScipyBackend,
+    PlannedBackend.name: PlannedBackend,
+}
+
+# Library each backend needs, and the backend to fall back to without it
+REQUIREMENTS = {
+    ScipyBackend.name: ("scipy", NumpyBackend.name),
+    PlannedBackend.name: ("pyfftw", ScipyBackend.name),
+}
+
+backend = None
+
+
+def create_backend(name="auto", workers=None):
+    """
+    Create an FFT backend, falling back to the next available one if its library is missing.
+
+    Parameters:
+    - name (str, optional): "numpy", "scipy", "planned", or "auto" for the fastest
+                            available one. Default is "auto".
+    - workers (int, optional): Number of threads per transform, for backends that support it.
+
+    Raises:
+    - ValueError: If the backend name is not supported.
+
+    Returns:
+    - The backend object, with rfft2(image, out=None), irfft2(half_spectrum, shape,
+      out=None), and the 1D
+      ifft(spectrum, axis) and irfft(half_spectrum, length) methods.
+    """
+    if name == "auto":
+        name = "scipy" if is_installed("scipy") else "numpy"
+    if name not in BACKENDS:
+        raise ValueError(f"Invalid FFT backend: {name}")
+
+    requested = name
+    while name in REQUIREMENTS and not is_installed(REQUIREMENTS[name][0]):
+        name = REQUIREMENTS[name][1]
+    if name != requested:
+        warnings.warn(
+            f"FFT backend '{requested}' is not available, using '{name}' instead"
+        )
+    return BACKENDS[name](workers)
+
+
+def set_backend(name="auto", workers=None):
+    """
+    Select the FFT backend used by every later transform.
+
+    Parameters:
+    - name (str, optional): "numpy", "scipy", "planned" or "auto". Default is "auto".
+    - workers (int, optional): Number of threads per transform.
+
+    Returns:
+    - The selected backend object.
+    """
+    global backend
+    backend = create_backend(name, workers)
+    return backend
+
+
+def get_backend():
+    """
+    Get the current FFT backend, creating it from IMAGE_MIXER_FFT_BACKEND and
+    IMAGE_MIXER_FFT_WORKERS on first use.
+
+    Returns:
+    - The current backend object.
+    """
+    if backend is None:
+        workers = os.environ.get("IMAGE_MIXER_FFT_WORKERS")
+        set_backend(
+            os.environ.get("IMAGE_MIXER_FFT_BACKEND", "auto"),
+            int(workers) if workers else None,
+        )
+    return backend
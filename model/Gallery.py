@@ -1,12 +1,140 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
 from model.Image import Image
+from model.SpectrumStack import SpectrumStack
 
 
 class Gallery:
     def __init__(self):
         self.ids_to_objects = {}
+        self.stack = None
+        self.stack_sources = None
+        self.executor = None
+        self.precomputing = {}
 
     def add_image(self, image_object, image_id):
         self.ids_to_objects[image_id] = image_object
 
     def get_gallery(self):
         return self.ids_to_objects
+
+    def get_stack(self):
+        """
+        Get the stacked spectra of all images in the gallery.
+
+        The stack is rebuilt only when an image is added, replaced or transformed again.
+
+        Returns:
+        - SpectrumStack: Stack of the gallery spectra, indexed by image ID.
+        """
+        ids = sorted(self.ids_to_objects)
+        sources = [self.ids_to_objects[image_id].get_fft() for image_id in ids]
+
+        # Reuse the stack while every slot still holds the same spectrum
+        if (
+            self.stack is None
+            or list(self.stack.index) != ids
+            or any(new is not old for new, old in zip(sources, self.stack_sources))
+        ):
+            images = [self.ids_to_objects[image_id] for image_id in ids]
+            self.stack = SpectrumStack(sources, ids, images[0].shape, images)
+            self.stack_sources = sources
+        return self.stack
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+        return self.executor
+
+    def precompute_inverses(self, images=None):
+        """
+        Precompute, in the background, the inverse transforms used by real/imaginary mixes
+        for every image that does not have them yet, e.g. after Image.reshape_all.
+
+        Images whose spectrum is memory-mapped from the spectrum store are skipped, their
+        real/imaginary mixes run in the frequency domain.
+
+        Parameters:
+        - images (list, optional): The images to precompute. Default is every gallery image.
+
+        Returns:
+        - None
+        """
+        if images is None:
+            images = list(self.ids_to_objects.values())
+        for image, (_, pending) in list(self.precomputing.items()):
+            if pending.done():
+                self.precomputing.pop(image, None)
+
+        for image in images:
+            if image.has_inverse("real") and image.has_inverse("imaginary"):
+                continue
+            # Spectra memory-mapped from the spectrum store stay out of RAM, and two
+            # full-size inverses per image would undo that
+            if isinstance(image.get_fft(), np.memmap):
+                continue
+            # Skip images already being precomputed for their current spectrum
+            fft, pending = self.precomputing.get(image, (None, None))
+            if fft is image.get_fft() and not pending.done():
+                continue
+            self.precomputing[image] = (
+                image.get_fft(),
+                self.get_executor().submit(image.precompute_inverses),
+            )
+
+    def load_many(self, paths, image_ids):
+        """
+        Load, resize and transform several images concurrently on a thread pool.
+
+        Decoding, resizing and the FFT release the GIL, so loading N images takes about
+        as long as the slowest one. All images are first decoded, then each one is resized
+        to the smallest size among them and the images already in the other slots, and
+        transformed. The images are not added to the gallery, so the caller can add each
+        one with add_image when its future completes, then call Image.reshape_all with the
+        shape of the loaded image to update the images already in the gallery. The images
+        of the batch already have that shape, so only the other slots are transformed.
+
+        Parameters:
+        - paths (list): Paths of the images to load.
+        - image_ids (list): Gallery ID each image will be added under, in the same order.
+
+        Returns:
+        - list: One future per path, whose result is the loaded Image.
+        """
+        executor = self.get_executor()
+        images = [Image() for _ in paths]
+        decoded = [
+            executor.submit(image.load_img, path) for image, path in zip(images, paths)
+        ]
+        kept = [
+            image
+            for image_id, image in self.ids_to_objects.items()
+            if image_id not in image_ids
+        ]
+
+        def transform(image, decoding):
+            # Every image must be decoded to know the common size
+            wait(decoded)
+            decoding.result()
+            loaded = [
+                other.original_image.shape
+                for other, other_decoding in zip(images, decoded)
+                if other_decoding.exception() is None
+            ]
+            shapes = loaded + [other.original_image.shape for other in kept]
+            image.reshape(
+                min(shape[0] for shape in shapes), min(shape[1] for shape in shapes)
+            )
+            image.compute_fourier_transform()
+            image.get_pyramid("image")
+            # Precomputed after the future completes, so the image is shown first
+            self.precompute_inverses([image])
+            return image
+
+        return [
+            executor.submit(transform, image, decoding)
+            for image, decoding in zip(images, decoded)
+        ]
@@ -1,6 +1,10 @@
-import cv2
+import hashlib
+
 import numpy as np
 
+from model import DisplayPyramid, Instrumentation, Precision, Spectrum, SpectrumStore
+from model.SpectrumCache import SpectrumCache, shared_cache
+
 
 class Image:
     id = 0
@@ -12,51 +16,145 @@ class Image:
         Attributes:
         - name (str): The name of the image extracted from the file path.
         - img (numpy.ndarray): The image data loaded from the specified path.
+        - original_image (numpy.ndarray): The full-resolution image data, every resize starts from it.
         - shape (tuple): The shape of the loaded image.
-        - fft (numpy.ndarray): The 2D Fourier Transform of the image.
-        - fft_shifted (numpy.ndarray): The shifted version of the Fourier Transform.
-        - magnitude (numpy.ndarray): The magnitude spectrum of the shifted Fourier Transform.
-        - phase (numpy.ndarray): The phase spectrum of the shifted Fourier Transform.
-        - real (numpy.ndarray): The real part of the shifted Fourier Transform.
-        - imaginary (numpy.ndarray): The imaginary part of the shifted Fourier Transform.
-        - components_shifted (None): Placeholder for components of the shifted Fourier Transform.
+        - content_hash (str): Hash of the source file content. Used with the shape as the spectrum cache key.
+        - fft (numpy.ndarray): The non-redundant half-spectrum of the image (real-input 2D Fourier Transform).
+        - components_shifted (dict): Cached log-scaled components of the centered full spectrum used
+                                     by the views, computed the first time they are read.
+        - inverses (dict): Cached inverse transforms of the real part and of the imaginary part of
+                           the spectrum alone, precomputed after loading for real/imaginary mixes.
+        - pyramids (dict): Cached display pyramids of the image ("image") and of the display
+                           components, built the first time they are shown.
         """
         self.id = Image.id
         Image.id += 1
         self.image = None
+        self.original_image = None
         self.shape = None
+        self.content_hash = None
 
         self.fft = None
-        self.fft_shifted = None
-        self.magnitude = None
-        self.phase = None
-        self.real = None
-        self.imaginary = None
-        self.components_shifted = None
+        self.components_shifted = {}
+        self.inverses = {}
+        self.pyramids = {}
 
     def get_id(self):
         return self.id
 
     def get_image(self):
-        return self.image.T
+        return self.image
 
     def get_fft(self):
         return self.fft
 
     def get_fft_shifted(self):
-        return self.fft_shifted
+        return Spectrum.expand_shifted(self.fft, self.shape[1])
 
     def get_magnitude(self):
-        return self.components_shifted[0].T
+        return self.get_component_shifted("magnitude")
 
     def get_phase(self):
-        return self.components_shifted[1].T
+        return self.get_component_shifted("phase")
 
     def get_real(self):
-        return self.components_shifted[2]
+        return self.get_component_shifted("real")
 
     def get_imaginary(self):
-        return self.components_shifted[3]
+        return self.get_component_shifted("imaginary")
+
+    def get_component_shifted(self, component):
+        """
+        Get a log-scaled component of the centered full spectrum for display,
+        computing and caching it on first use.
+
+        Parameters:
+        - component (str): One of "magnitude", "phase", "real" or "imaginary".
+
+        Returns:
+        - numpy.ndarray: The requested component of the centered full spectrum.
+        """
+        if component not in self.components_shifted:
+            # The views show the full centered spectrum, rebuilt from the half-spectrum
+            fft_shifted = Spectrum.expand_shifted(self.fft, self.shape[1])
+            if component == "magnitude":
+                value = np.log(np.abs(fft_shifted) + 1)
+            elif component == "phase":
+                value = np.angle(fft_shifted)
+            elif component == "real":
+                value = np.log(fft_shifted.real + 1)
+            elif component == "imaginary":
+                value = np.log(fft_shifted.imag + 1)
+            else:
+                raise ValueError(f"Invalid component: {component}")
+            self.components_shifted[component] = value
+        return self.components_shifted[component]
+
+    def get_pyramid(self, component):
+        """
+        Get the display pyramid of the image or of a display component, building and
+        caching it on first use.
+
+        Parameters:
+        - component (str): "image", or one of "magnitude", "phase", "real" or "imaginary".
+
+        Returns:
+        - list: The levels, from the array returned by the matching getter to the smallest one.
+        """
+        if component not in self.pyramids:
+            if component == "image":
+                array = self.get_image()
+            elif component == "magnitude":
+                array = self.get_magnitude()
+            elif component == "phase":
+                array = self.get_phase()
+            elif component == "real":
+                array = self.get_real()
+            elif component == "imaginary":
+                array = self.get_imaginary()
+            else:
+                raise ValueError(f"Invalid component: {component}")
+            self.pyramids[component] = DisplayPyramid.build(array)
+        return self.pyramids[component]
+
+    def get_inverse(self, component):
+        """
+        Get the inverse transform of the real or imaginary part of the spectrum alone,
+        computing and caching it on first use.
+
+        Parameters:
+        - component (str): "real" for irfft2(Re F), or "imaginary" for irfft2(j Im F).
+
+        Returns:
+        - numpy.ndarray: Real image of the same shape as the image.
+        """
+        inverses = self.inverses
+        if component not in inverses:
+            inverses[component] = Spectrum.inverse_component(
+                self.fft, component, self.shape
+            )
+        return inverses[component]
+
+    def has_inverse(self, component):
+        return component in self.inverses
+
+    def precompute_inverses(self):
+        # Real/imaginary mixes without a crop are then weighted sums of these images
+        for component in ("real", "imaginary"):
+            self.get_inverse(component)
+
+    def clear_cache(self):
+        """
+        Drop every cached component derived from the spectrum.
+
+        The half-spectrum itself is kept, so components are recomputed on demand.
+
+        Returns:
+        - None
+        """
+        self.components_shifted = {}
+        self.inverses = {}
+        self.pyramids = {}
 
     def load_img(self, image_path):
         """
@@ -72,14 +170,46 @@ class Image:
         Returns:
         - None
         """
-        self.image = cv2.imread(image_path).astype(np.float32)
+        # OpenCV is imported on the first load, so it does not slow down startup
+        import cv2
+
+        # Read the file once, so its content can be hashed for the spectrum cache
+        data = np.fromfile(image_path, dtype=np.uint8)
+        self.content_hash = hashlib.sha1(data).hexdigest()
+
+        self.image = cv2.imdecode(data, cv2.IMREAD_COLOR).astype(np.float32)
         self.image = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        self.original_image = self.image
         self.shape = self.image.shape
+        self.fft = None
+        self.clear_cache()
+
+    def set_image(self, image):
+        """
+        Use an already decoded grayscale image, such as a video frame.
+
+        The image has no content hash, so its spectrum is never cached or stored.
+
+        Parameters:
+        - image (numpy.ndarray): 2D float image. It is used as is, not copied.
+
+        Returns:
+        - None
+        """
+        self.content_hash = None
+        self.image = image
+        self.original_image = image
+        self.shape = image.shape
+        self.fft = None
+        self.clear_cache()
 
     def reshape(self, new_height, new_width):
         """
         Resize the image to the specified dimensions.
 
+        The image is always resized from the full-resolution original, so repeated
+        resizes do not degrade it.
+
         Parameters:
         - new_height (int): The new height of the image.
         - new_width (int): The new width of the image.
@@ -87,35 +217,65 @@ class Image:
         Returns:
         - None
         """
-        # Resize the image
-        self.image = cv2.resize(self.image, (new_width, new_height))
+        if self.shape == (new_height, new_width):
+            return
+
+        # Resize the image from the full-resolution original
+        if self.original_image.shape == (new_height, new_width):
+            self.image = self.original_image
+        else:
+            import cv2
+
+            self.image = cv2.resize(self.original_image, (new_width, new_height))
         # Update the shape attribute
         self.shape = self.image.shape
+        # The spectrum no longer matches the pixels
+        self.fft = None
+        self.clear_cache()
 
     @classmethod
-    def reshape_all(cls, image_instances):
+    def reshape_all(cls, image_instances, shape=None):
         """
-        Resize all images in a list of Image instances to the smallest dimensions among them.
+        Resize all images in a list of Image instances to the smallest dimensions among them,
+        or to a given shape.
+
+        Only the images whose shape differs from the target, or which have no spectrum
+        yet, are resized and transformed again.
 
         Parameters:
         - cls (class): The class reference.
         - image_instances (list): List of Image instances to be resized.
+        - shape (tuple, optional): (height, width) to resize to, e.g. the common size of
+                                   a batch from Gallery.load_many. Default is the smallest
+                                   original dimensions among the instances.
 
         Returns:
         - None
         """
-        # Find the smallest image dimensions among all instances
-        min_height = min(inst.image.shape[0] for inst in image_instances)
-        min_width = min(inst.image.shape[1] for inst in image_instances)
-
-        # Resize all images to the smallest dimensions
+        if shape is not None:
+            min_height, min_width = shape
+        else:
+            # Find the smallest original dimensions among all instances
+            min_height = min(inst.original_image.shape[0] for inst in image_instances)
+            min_width = min(inst.original_image.shape[1] for inst in image_instances)
+
+        # Resize and transform only the images that are out of date
         for inst in image_instances:
-            inst.reshape(min_height, min_width)
-            inst.compute_fourier_transform()
+            if inst.shape != (min_height, min_width) or inst.fft is None:
+                inst.reshape(min_height, min_width)
+                inst.compute_fourier_transform()
 
     def compute_fourier_transform(self, show=True):
         """
-        Compute the 2D Fourier Transform and related components of the image.
+        Compute the 2D Fourier Transform of the image.
+
+        Derived components are not computed here; the display components are computed
+        and cached the first time they are read through the display getters, and the
+        mixer derives its components from the spectrum stack.
+
+        The spectrum is looked up in the shared spectrum cache first. When the on-disk
+        spectrum store is enabled, it is then looked up there, and a computed spectrum is
+        written to it and kept as a read-only memory map instead of in RAM.
 
         Parameters:
         - show (bool, optional): If True, display visualizations of the Fourier Transform components.
@@ -124,28 +284,28 @@ class Image:
         Returns:
         - None
         """
-        # Compute the 2D Fourier Transform
-        self.fft = np.fft.fft2(self.image)
-
-        # Shift the zero-frequency component to the center
-        self.fft_shifted = np.fft.fftshift(self.fft)
-
-        # Compute the magnitude of the spectrum
-        self.magnitude = np.abs(self.fft)
-
-        # Compute the phase of the spectrum
-        self.phase = np.angle(self.fft)
-
-        # real ft components
-        self.real = self.fft.real
-
-        # imaginary ft components
-        self.imaginary = self.fft.imag
-
-        # Compute the components of the shifted Fourier Transform
-        self.components_shifted = [
-            np.log(np.abs(self.fft_shifted) + 1),
-            np.angle(self.fft_shifted),
-            np.log(self.fft_shifted.real + 1),
-            np.log(self.fft_shifted.imag + 1),
-        ]
+        with Instrumentation.stage("fft", shape=self.shape) as fft_stage:
+            key = None
+            if self.content_hash is not None:
+                key = SpectrumCache.make_key(
+                    self.content_hash, self.shape, Precision.complex_dtype()
+                )
+                self.fft = shared_cache.get(key)
+                fft_stage.note(source="cache")
+
+            store = SpectrumStore.shared_store
+            if key is not None and self.fft is None and store is not None:
+                self.fft = store.load(key)
+                fft_stage.note(source="store")
+
+            if key is None or self.fft is None:
+                # Compute the non-redundant half-spectrum of the real image
+                self.fft = Spectrum.forward(self.image)
+                fft_stage.note(source="computed")
+                if key is not None and store is not None:
+                    self.fft = store.save(key, self.fft)
+                elif key is not None:
+                    shared_cache.put(key, self.fft)
+
+        # Components are derived lazily from the new spectrum
+        self.clear_cache()
@@ -1,31 +1,111 @@
+import threading
+
 from PyQt6.QtCore import QThread, pyqtSignal
-from model.Mixer import Mixer
+from model import Instrumentation
+from model.Mixer import MixCancelled, Mixer
 
 
 class ImageProcessingThread(QThread):
     processingDone = pyqtSignal(object)
+    processingFailed = pyqtSignal(str)
+    progressChanged = pyqtSignal(int)
+
+    def __init__(self, gallery, pool=None):
+        """
+        Initialize the persistent mixing worker.
+
+        The worker runs one mix at a time. Submitting while a mix is pending replaces the
+        pending one, so only the latest parameters are computed, and submitting or
+        cancelling while a mix runs stops it at its next stage.
 
-    def __init__(
-        self, weights, componentsIds, componentsTypes, gallery, cropMode, currentState
-    ):
+        Parameters:
+        - gallery (Gallery): The gallery the images are mixed from.
+        - pool (SharedSpectrumPool, optional): If given, mixes run in its worker processes
+                                               instead of this thread.
+
+        Attributes:
+        - pending (tuple): The next job to run, or None.
+        - generation (int): Incremented on every submit and cancel; a running job whose
+                            generation is older is stale and stops at its next stage.
+        """
         QThread.__init__(self)
-        self.weights = weights
-        self.componentsIds = componentsIds
-        self.componentsTypes = componentsTypes
         self.gallery = gallery
-        self.cropMode = cropMode
-        self.currentState = currentState
+        self.pool = pool
+        self.condition = threading.Condition()
+        self.pending = None
+        self.generation = 0
+        self.running = True
+
+    def submit(self, weights, componentsIds, componentsTypes, cropMode, currentState):
+        with self.condition:
+            self.generation += 1
+            # Copy the parameters, the window keeps changing its own lists
+            self.pending = (
+                self.generation,
+                list(weights),
+                list(componentsIds),
+                list(componentsTypes),
+                cropMode,
+                dict(currentState),
+            )
+            self.condition.notify()
+
+    def cancel(self):
+        with self.condition:
+            self.generation += 1
+            self.pending = None
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.generation += 1
+            self.pending = None
+            self.condition.notify()
+        self.wait()
+
+    def reportProgress(self, generation, fraction):
+        if generation != self.generation:
+            raise MixCancelled()
+        self.progressChanged.emit(int(fraction * 100))
 
     def run(self):
-        currentMixer = Mixer(self.weights, self.componentsTypes, *self.componentsIds)
-        coords = [
-            self.currentState["pos"][0],
-            self.currentState["pos"][0] + self.currentState["size"][0],
-            self.currentState["pos"][1],
-            self.currentState["pos"][1] + self.currentState["size"][1],
-        ]
-        coords = [int(coord) for coord in coords]
-        output = currentMixer.inverse_fft(
-            self.gallery.get_gallery(), self.cropMode, coords
-        ).T
-        self.processingDone.emit(output)
+        while True:
+            with self.condition:
+                while self.running and self.pending is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                job = self.pending
+                self.pending = None
+
+            generation, weights, componentsIds, componentsTypes, cropMode, state = job
+            coords = Mixer.roi_dimensions(state)
+            progress = lambda fraction: self.reportProgress(generation, fraction)
+            try:
+                with Instrumentation.stage("mix", generation=generation):
+                    if self.pool is not None:
+                        with Instrumentation.stage("pool_mix"):
+                            handle = self.pool.submit(
+                                self.gallery,
+                                weights,
+                                componentsTypes,
+                                componentsIds,
+                                cropMode,
+                                coords,
+                            )
+                            output = self.pool.wait(handle, progress)
+                    else:
+                        currentMixer = Mixer(weights, componentsTypes, *componentsIds)
+                        output = currentMixer.inverse_fft(
+                            self.gallery, cropMode, coords, progress=progress
+                        )
+            except MixCancelled:
+                continue
+            except Exception as error:
+                # A failed mix must not stop the worker, later submits still run
+                if generation == self.generation:
+                    self.processingFailed.emit(f"Could not mix: {error!r}")
+                continue
+
+            if generation == self.generation:
+                self.processingDone.emit(output)
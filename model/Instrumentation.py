@@ -0,0 +1,264 @@
+"""
+Per-stage timing and memory instrumentation of the processing pipeline.
+
+Set IMAGE_MIXER_TRACE=1 (or call set_enabled) to record every pipeline stage with its
+wall time, the bytes it allocated at its peak, and the shapes it worked on. Stages are
+opened with ``with Instrumentation.stage("name", shape=...):`` and may be nested.
+Recorded stages can be summarized for the status bar and exported as a Chrome trace
+(chrome://tracing or https://ui.perfetto.dev).
+
+When disabled, stage returns a shared no-op context, so an instrumented stage costs one
+function call. Memory is measured with tracemalloc, which is only started when enabled.
+
+The tracemalloc peak is process-wide, and every stage resets it. The allocated bytes
+of a stage are therefore only recorded when no stage ran on another thread while it
+was open; a stage that overlapped one, e.g. on the per-channel mixing workers or the
+loader pool, is recorded with allocated_bytes None and overlapped True. Allocations of
+threads without an open stage are still counted in the peak.
+"""
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# Oldest stages are dropped past this many
+MAX_EVENTS = 100000
+
+enabled = False
+events = deque(maxlen=MAX_EVENTS)
+latest = {}
+thread_names = {}
+local = threading.local()
+origin = time.perf_counter()
+# Traced stages open in every thread, and opened so far, to detect overlapping stages
+memory_lock = threading.Lock()
+open_stages = 0
+opened_stages = 0
+
+
+class Stage:
+    __slots__ = (
+        "name",
+        "args",
+        "start",
+        "base",
+        "peak",
+        "leaves",
+        "opened",
+        "overlapped",
+    )
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.leaves = []
+
+    def note(self, **args):
+        """
+        Add details to the stage, such as the shape of an array it produced.
+        """
+        self.args.update(args)
+
+    def __enter__(self):
+        global open_stages, opened_stages
+        stack = getattr(local, "stack", None)
+        if stack is None:
+            stack = local.stack = []
+            local.open = local.opened = 0
+        if tracemalloc.is_tracing():
+            with memory_lock:
+                current, peak = tracemalloc.get_traced_memory()
+                # The peak is reset for this stage, so the parent keeps the peak so far
+                if stack:
+                    stack[-1].peak = max(stack[-1].peak, peak)
+                tracemalloc.reset_peak()
+                self.base = self.peak = current
+                # Stages of other threads already open share the peak with this one
+                self.overlapped = open_stages > local.open
+                open_stages += 1
+                opened_stages += 1
+                local.open += 1
+                local.opened += 1
+                self.opened = opened_stages - local.opened
+        else:
+            self.base = None
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        global open_stages
+        end = time.perf_counter()
+        stack = local.stack
+        stack.pop()
+
+        event = {
+            "name": self.name,
+            "ph": "X",
+            "ts": (self.start - origin) * 1e6,
+            "dur": (end - self.start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {key: format_value(value) for key, value in self.args.items()},
+        }
+        if self.base is not None:
+            with memory_lock:
+                open_stages -= 1
+                local.open -= 1
+                # A stage opened by another thread meanwhile reset the peak
+                overlapped = (
+                    self.overlapped or opened_stages - local.opened != self.opened
+                )
+                tracing = tracemalloc.is_tracing()
+                if tracing:
+                    self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if tracing and overlapped:
+                event["args"]["allocated_bytes"] = None
+                event["args"]["overlapped"] = True
+            elif tracing:
+                event["args"]["allocated_bytes"] = self.peak - self.base
+            if tracing and stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+        if exception_type is not None:
+            event["args"]["error"] = exception_type.__name__
+
+        events.append(event)
+        thread_names.setdefault(event["tid"], threading.current_thread().name)
+        # Innermost stages are the ones shown in summaries
+        if stack:
+            stack[-1].leaves.extend(self.leaves or [event])
+        else:
+            latest[self.name] = (event, self.leaves)
+        return False
+
+
+class NullStage:
+    __slots__ = ()
+
+    def note(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+def format_value(value):
+    # Shapes and dtypes are stored in a JSON-friendly form
+    if isinstance(value, tuple):
+        return list(value)
+    if isinstance(value, (int, float, str, bool, list)) or value is None:
+        return value
+    return str(value)
+
+
+def stage(name, **args):
+    """
+    Open a pipeline stage.
+
+    Parameters:
+    - name (str): Name of the stage.
+    - **args: Details recorded with the stage, such as array shapes.
+
+    Returns:
+    - A context manager, with a note(**args) method to add details while it runs.
+    """
+    if not enabled:
+        return NULL_STAGE
+    return Stage(name, args)
+
+
+def set_enabled(value=True):
+    """
+    Enable or disable the instrumentation.
+
+    Enabling it starts tracemalloc, which slows allocations down while it traces.
+
+    Parameters:
+    - value (bool, optional): Whether stages are recorded. Default is True.
+
+    Returns:
+    - None
+    """
+    global enabled
+    enabled = bool(value)
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled():
+    return enabled
+
+
+def clear():
+    events.clear()
+    latest.clear()
+
+
+def summarize(*names):
+    """
+    Describe the last run of top-level stages, with the time of each of their innermost stages.
+
+    Parameters:
+    - *names (str): Names of the top-level stages.
+
+    Returns:
+    - str: e.g. "mix 120.0 ms, 8.0 MB (ifft 60.0 ms, abs_clip 2.0 ms)", or "" if none ran.
+    """
+    parts = []
+    for name in names:
+        if name not in latest:
+            continue
+        event, leaves = latest[name]
+        text = f"{name} {event['dur'] / 1e3:.1f} ms"
+        if event["args"].get("allocated_bytes") is not None:
+            text += f", {event['args']['allocated_bytes'] / 2**20:.1f} MB"
+        if leaves:
+            details = ", ".join(
+                f"{leaf['name']} {leaf['dur'] / 1e3:.1f} ms" for leaf in leaves
+            )
+            text += f" ({details})"
+        parts.append(text)
+    return " | ".join(parts)
+
+
+def export_chrome_trace(path):
+    """
+    Write the recorded stages as a Chrome trace.
+
+    Parameters:
+    - path (str): Path of the JSON trace file.
+
+    Returns:
+    - int: Number of stages written.
+    """
+    recorded = list(events)
+    metadata = [
+        {
+            "name": "thread_name",
+            "ph": "M",
+            "pid": os.getpid(),
+            "tid": tid,
+            "args": {"name": name},
+        }
+        for tid, name in thread_names.items()
+    ]
+    with open(path, "w") as trace_file:
+        json.dump(
+            {"traceEvents": metadata + recorded, "displayTimeUnit": "ms"}, trace_file
+        )
+    return len(recorded)
+
+
+if os.environ.get("IMAGE_MIXER_TRACE", "") not in ("", "0"):
+    set_enabled(True)
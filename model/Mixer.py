@@ -1,5 +1,19 @@
+import os
+import tempfile
+
 import numpy as np
 
+from model import Instrumentation, RegionMask, Spectrum
+from model.Gallery import Gallery
+from model.SpectrumStack import SpectrumStack
+
+# Memory budget of the working arrays of an out-of-core mix
+TILE_BUDGET_MB = float(os.environ.get("IMAGE_MIXER_TILE_BUDGET_MB", 256))
+
+
+class MixCancelled(Exception):
+    pass
+
 
 class Mixer:
     def __init__(
@@ -85,69 +99,327 @@ class Mixer:
         else:
             raise ValueError("Invalid types")
 
-    def inverse_fft(self, gallery, crop_mode=None, dimensions=None):
+    def get_stack(self, gallery):
+        """
+        Gets the stacked spectra of the images used by the mixer.
+
+        Parameters:
+        - gallery (Gallery, SpectrumStack or dict): The gallery, a stack of spectra keyed by image ID,
+                                                    or a dictionary of images where keys are image IDs.
+
+        Returns:
+        - SpectrumStack: Stack containing at least the four mixed images.
+        """
+        if isinstance(gallery, SpectrumStack):
+            return gallery
+        if isinstance(gallery, Gallery):
+            return gallery.get_stack()
+
+        images = self.extract_image(gallery)
+        ids = list(dict.fromkeys(self.get_ids()))
+        return SpectrumStack(
+            [gallery[image_id].get_fft() for image_id in ids], ids, images[0].shape
+        )
+
+    def get_ids(self):
+        return [self.image1_id, self.image2_id, self.image3_id, self.image4_id]
+
+    def component_weights(self, stack, component, scale=1):
+        """
+        Builds the weight vector applied to a component stack.
+
+        Each of the four items adds its weight to the position of its image in the stack
+        if its type matches the component.
+
+        Parameters:
+        - stack (SpectrumStack): The stack the weights are applied to.
+        - component (str): One of "magnitude", "phase", "real" or "imaginary".
+        - scale (float, optional): Factor applied to every weight. Default is 1.
+
+        Returns:
+        - numpy.ndarray or None: One weight per stacked spectrum, or None if no item uses the component.
+        """
+        weights = np.zeros(len(stack), dtype=stack.real_dtype)
+        used = False
+        for image_id, type, weight in zip(self.get_ids(), self.types, self.weights):
+            if type == component:
+                weights[stack.index[image_id]] += scale * weight
+                used = True
+        return weights if used else None
+
+    def linear_weights(self, stack, component):
+        weights = self.component_weights(stack, component)
+        if weights is None:
+            return np.zeros(len(stack), dtype=stack.real_dtype)
+        return weights
+
+    def mix_component(self, stack, component, scale=1, rows=None):
+        """
+        Mix one component of the stack, over every row or over a band of rows.
+
+        Parameters:
+        - stack (SpectrumStack): The stack to mix.
+        - component (str): One of "magnitude", "phase", "real" or "imaginary".
+        - scale (float, optional): Factor applied to every weight. Default is 1.
+        - rows (tuple, optional): (start, stop) of a band of rows, read without caching
+                                  any component stack. Default is every row.
+
+        Returns:
+        - numpy.ndarray: The mixed component.
+        """
+        start, stop = rows or (0, stack.half_shape[0])
+        weights = self.component_weights(stack, component, scale)
+        if weights is None:
+            return np.zeros((stop - start, stack.half_shape[1]), dtype=stack.real_dtype)
+        if rows is None:
+            return stack.weighted_sum(component, weights)
+        return stack.weighted_rows(component, weights, start, stop)
+
+    def mix_spectrum(self, stack, mode, spectrum, rows=None, report=None):
+        """
+        Combine the mixed components into a half-spectrum, or into a band of its rows.
+
+        Parameters:
+        - stack (SpectrumStack): The stack to mix.
+        - mode (int): Mode from choose_mode.
+        - spectrum (numpy.ndarray): Complex array the mixed spectrum is written to.
+        - rows (tuple, optional): (start, stop) of the band of rows held by spectrum.
+        - report (callable, optional): Called with the completed fraction after each component.
+
+        Returns:
+        - numpy.ndarray: The mixed spectrum (the same array).
+        """
+        report = report or (lambda fraction: None)
+
+        # magnitude and phase mode
+        if mode == 2:
+            with Instrumentation.stage("magnitude", shape=spectrum.shape):
+                magnitudes = self.mix_component(stack, "magnitude", 2, rows)
+            report(0.3)
+            with Instrumentation.stage("phase", shape=spectrum.shape):
+                phases = self.mix_component(stack, "phase", 2, rows)
+            report(0.5)
+
+            with Instrumentation.stage("exp", shape=spectrum.shape):
+                np.multiply(phases, 1j, out=spectrum)
+                np.exp(spectrum, out=spectrum)
+                spectrum *= magnitudes
+
+        # real and imaginary mode
+        elif mode == 1:
+            with Instrumentation.stage("real", shape=spectrum.shape):
+                spectrum.real = self.mix_component(stack, "real", 1, rows)
+            report(0.3)
+            with Instrumentation.stage("imaginary", shape=spectrum.shape):
+                spectrum.imag = self.mix_component(stack, "imaginary", 1, rows)
+            report(0.5)
+
+        return spectrum
+
+    @staticmethod
+    def roi_dimensions(state):
+        """
+        Converts the state of an ROI into the dimensions used by inverse_fft.
+
+        Parameters:
+        - state (dict): ROI state with "pos" and "size" entries.
+
+        Returns:
+        - list: x1,x2,y1,y2 as integers.
+        """
+        coords = [
+            state["pos"][0],
+            state["pos"][0] + state["size"][0],
+            state["pos"][1],
+            state["pos"][1] + state["size"][1],
+        ]
+        return [int(coord) for coord in coords]
+
+    def inverse_fft(
+        self,
+        gallery,
+        crop_mode=None,
+        dimensions=None,
+        preview_size=None,
+        progress=None,
+    ):
         """
         Performs inverse FFT on images extracted from the given gallery based on stored parameters.
 
+        The weighted components are computed as contractions over the stacked spectra of the gallery.
+        The mix runs in the precision of the spectra (see model.Precision).
+
+        Mixes are incremental: when only some weights or component types changed since the
+        last mix of the same stack, the component sums are updated by the changed images
+        only, and a real/imaginary mix is updated in image space, usually without any new
+        inverse transform (see SpectrumStack.weighted_sum and SpectrumStack.remix_inverse).
+
         Parameters:
-        - gallery (dict): A dictionary representing a gallery of images where keys are image IDs.
+        - gallery (Gallery, SpectrumStack or dict): The gallery, a stack of spectra keyed by image ID,
+                                                    or a dictionary of images where keys are image IDs.
         - crop_mode (int): 1 for inner, 2 for outer
-        - dimensions (list): x1,x2,y1,y2
+        - dimensions (list): x1,x2,y1,y2 on the centered spectrum
+        - preview_size (int, optional): If given, mix a low-resolution preview whose largest
+                                        side is at most this size.
+        - progress (callable, optional): Called with the completed fraction (0 to 1) between
+                                         stages. It may raise MixCancelled to stop the mix.
         Returns:
         - ndarray: Reconstructed image using inverse FFT.
 
         Raises:
         - ValueError: If the mode determined by the types is not supported (not all "magnitude" or "phase").
         """
-        images = self.extract_image(gallery)
-        mask = np.ones(images[0].shape)
-
-        # inner mode
-        if crop_mode == 1:
-            mask = np.zeros(images[0].shape)
-            mask[
-                dimensions[2] : dimensions[3] + 1, dimensions[0] : dimensions[1] + 1
-            ] = 1
-
-        # outer mode
-        elif crop_mode == 2:
-            mask = np.ones(images[0].shape)
-            mask[
-                dimensions[2] : dimensions[3] + 1, dimensions[0] : dimensions[1] + 1
-            ] = 0
+        report = progress or (lambda fraction: None)
+
+        with Instrumentation.stage(
+            "inverse_fft", crop_mode=crop_mode, preview_size=preview_size
+        ) as mix_stage:
+            with Instrumentation.stage("extract") as extract_stage:
+                stack = self.get_stack(gallery)
+                if preview_size is not None:
+                    preview = stack.get_preview(preview_size)
+                    if dimensions is not None:
+                        dimensions = Spectrum.crop_dimensions(
+                            dimensions, stack.shape, preview.shape
+                        )
+                    stack = preview
+                shape = stack.shape
+                half_shape = stack.half_shape
+                extract_stage.note(shape=half_shape, dtype=stack.dtype)
+
+            mode = self.choose_mode()
+            mix_stage.note(shape=shape, mode=mode)
+            # inner (1) and outer (2) masks, drawn on the centered spectrum
+            mask = RegionMask.get_mask(shape, crop_mode, dimensions)
+            report(0.1)
+
+            output = None
+            if mode == 1:
+                # The inverse transform is linear, so a real/imaginary mix whose
+                # weights changed is updated in image space when that is cheaper
+                weights = {
+                    component: self.linear_weights(stack, component)
+                    for component in ("real", "imaginary")
+                }
+                with Instrumentation.stage("remix", shape=shape):
+                    output = stack.remix_inverse(weights, mask)
+
+            if output is None:
+                spectrum = np.empty(half_shape, dtype=stack.dtype)
+                self.mix_spectrum(stack, mode, spectrum, report=report)
+
+                with Instrumentation.stage("mask", shape=half_shape):
+                    if mask is not None:
+                        mask.apply(spectrum)
+                report(0.6)
+
+                with Instrumentation.stage("ifft", shape=shape):
+                    output = Spectrum.inverse(spectrum, shape)
+                if mode == 1:
+                    stack.remember_inverse(weights, mask, output)
+            report(0.9)
+
+            with Instrumentation.stage("abs_clip", shape=shape):
+                output = np.clip(np.abs(output), 0, 225)
+            report(1.0)
+        return output
 
+    def inverse_fft_tiled(
+        self,
+        gallery,
+        crop_mode=None,
+        dimensions=None,
+        budget_mb=None,
+        output=None,
+        scratch_dir=None,
+        progress=None,
+    ):
+        """
+        Performs the same mix as inverse_fft out of core, for images larger than memory.
+
+        The mixed half-spectrum is built band by band of rows into a memory-mapped
+        scratch file. The 2D inverse transform is then done as two separable passes
+        over it: an inverse transform of the columns, strip by strip, followed by a
+        real inverse transform of the rows, band by band. Each band and strip is sized
+        so the working arrays stay within the budget. Spectra memory-mapped from the
+        spectrum store are read a band at a time, so no image-sized array is held in
+        memory other than the output, which may be memory-mapped too.
+
+        Parameters:
+        - gallery (Gallery, SpectrumStack or dict): As for inverse_fft.
+        - crop_mode (int): 1 for inner, 2 for outer
+        - dimensions (list): x1,x2,y1,y2 on the centered spectrum
+        - budget_mb (float, optional): Memory budget of the working arrays, in megabytes.
+                                       Default is IMAGE_MIXER_TILE_BUDGET_MB, or 256.
+        - output (numpy.ndarray, optional): Array of shape (height, width) the image is
+                                            written to, such as a numpy.memmap.
+                                            Default is a new in-memory array.
+        - scratch_dir (str, optional): Directory of the scratch file. Default is the
+                                       system temporary directory.
+        - progress (callable, optional): As for inverse_fft.
+
+        Returns:
+        - ndarray: Reconstructed image, the same as inverse_fft gives.
+        """
+        report = progress or (lambda fraction: None)
+
+        stack = self.get_stack(gallery)
+        height, width = stack.shape
+        kept = stack.half_shape[1]
+        budget = (budget_mb or TILE_BUDGET_MB) * 2**20
+        complex_size = np.dtype(stack.dtype).itemsize
+        real_size = np.dtype(stack.real_dtype).itemsize
+
+        mask = RegionMask.get_mask(stack.shape, crop_mode, dimensions)
         mode = self.choose_mode()
+        if output is None:
+            output = np.empty(stack.shape, dtype=stack.real_dtype)
 
-        # magnitude and phase mode
-        if mode == 2:
-            magnitudes = np.zeros(images[0].shape)
-            phases = np.zeros(images[0].shape)
-
-            for i, image in enumerate(images):
-                if self.types[i] == "magnitude":
-                    magnitudes += 2 * self.weights[i] * np.abs(image.get_fft_shifted())
-                elif self.types[i] == "phase":
-                    phases += 2 * self.weights[i] * np.angle(image.get_fft_shifted())
-
-            return np.clip(
-                np.abs(
-                    np.fft.ifft2((magnitudes * mask) * np.exp(1j * (phases * mask)))
-                ),
-                0,
-                225,
+        with tempfile.TemporaryFile(dir=scratch_dir) as scratch_file:
+            spectrum = np.memmap(
+                scratch_file, dtype=stack.dtype, mode="w+", shape=stack.half_shape
             )
 
-        # real and imaginary mode
-        elif mode == 1:
-            real = np.zeros(images[0].shape)
-            imaginary = np.zeros(images[0].shape)
+            # Mix band by band: two component sums, a term and a source band per row
+            rows = self.band_size(budget, kept * (3 * real_size + 2 * complex_size))
+            for start in range(0, height, rows):
+                stop = min(start + rows, height)
+                band = np.empty((stop - start, kept), dtype=stack.dtype)
+                self.mix_spectrum(stack, mode, band, (start, stop))
+                if mask is not None:
+                    mask.apply(band, start)
+                spectrum[start:stop] = band
+                report(0.4 * stop / height)
 
-            for i, image in enumerate(images):
-                if self.types[i] == "real":
-                    real += self.weights[i] * image.real
-                elif self.types[i] == "imaginary":
-                    imaginary += self.weights[i] * image.imaginary
+            # Inverse transform the columns: a strip, its transform and a work buffer
+            columns = self.band_size(budget, height * 3 * complex_size)
+            for start in range(0, kept, columns):
+                stop = min(start + columns, kept)
+                spectrum[:, start:stop] = Spectrum.inverse_columns(
+                    np.asarray(spectrum[:, start:stop])
+                )
+                report(0.4 + 0.3 * stop / kept)
 
-            return np.clip(
-                np.abs(np.fft.ifft2(real * mask + imaginary * mask * 1j)), 0, 225
+            # Inverse transform the rows into the output, then clip as inverse_fft does
+            rows = self.band_size(
+                budget, kept * 2 * complex_size + width * 2 * real_size
             )
+            for start in range(0, height, rows):
+                stop = min(start + rows, height)
+                image = Spectrum.inverse_rows(np.asarray(spectrum[start:stop]), width)
+                output[start:stop] = np.clip(np.abs(image), 0, 225)
+                report(0.7 + 0.3 * stop / height)
+
+            del spectrum
+
+        if isinstance(output, np.memmap):
+            output.flush()
+        report(1.0)
+        return output
+
+    @staticmethod
+    def band_size(budget, bytes_per_line):
+        """
+        Number of rows (or columns) whose working arrays fit in the budget, at least one.
+        """
+        return max(1, int(budget // bytes_per_line))
@@ -0,0 +1,224 @@
+from functools import lru_cache
+
+from model import Spectrum
+
+
+class RegionMask:
+    def __init__(self, shape, crop_mode, dimensions):
+        """
+        Initialize a region mask translated from the centered spectrum into half-spectrum space.
+
+        The region is drawn on the centered (shifted) full spectrum, so it is moved back
+        to the unshifted layout, where it may wrap around the edges and split into up to
+        four rectangles. The real-input transform only keeps the first columns, and every
+        other bin (k, l) is implied by its Hermitian mirror (-k mod H, -l mod W). Each
+        rectangle is therefore added twice, as is and mirrored, and both are restricted
+        to the kept columns, so the mask covers the region and its mirror and the mixed
+        output stays a real image.
+
+        The mask is stored as disjoint slices, so applying it is a few slice assignments
+        instead of a dense multiplication.
+
+        Parameters:
+        - shape (tuple): (height, width) of the real image.
+        - crop_mode (int): 1 for inner, 2 for outer.
+        - dimensions (tuple): x1,x2,y1,y2 in centered spectrum coordinates, inclusive.
+
+        Attributes:
+        - crop_mode (int): 1 for inner, 2 for outer.
+        - slices (list): Disjoint (row slice, column slice) pairs covering the region in
+                         half-spectrum space.
+        """
+        height, width = shape
+        x1, x2, y1, y2 = dimensions
+        kept = Spectrum.half_width(width)
+
+        rectangles = []
+        for row_range in self.unshift_range(y1, y2, height):
+            for column_range in self.unshift_range(x1, x2, width):
+                rectangles.append((row_range, column_range))
+                for mirrored_rows in self.mirror_range(*row_range, height):
+                    for mirrored_columns in self.mirror_range(*column_range, width):
+                        rectangles.append((mirrored_rows, mirrored_columns))
+
+        self.crop_mode = crop_mode
+        self.slices = [
+            (slice(row_start, row_stop), slice(column_start, column_stop))
+            for (row_start, row_stop), (column_start, column_stop) in self.merge(
+                [
+                    (rows, (columns[0], min(columns[1], kept)))
+                    for rows, columns in rectangles
+                    if columns[0] < kept
+                ]
+            )
+        ]
+
+    def get_key(self):
+        # Masks with equal keys zero the same half-spectrum bins
+        return (
+            self.crop_mode,
+            tuple(
+                (rows.start, rows.stop, columns.start, columns.stop)
+                for rows, columns in self.slices
+            ),
+        )
+
+    @staticmethod
+    def unshift_range(first, last, size):
+        """
+        Map an inclusive index range of a centered axis to ranges of the unshifted axis.
+
+        Parameters:
+        - first (int): First index of the range on the centered axis.
+        - last (int): Last index of the range on the centered axis.
+        - size (int): Length of the axis.
+
+        Returns:
+        - list: Half-open (start, stop) ranges on the unshifted axis.
+        """
+        first = max(first, 0)
+        last = min(last, size - 1)
+        if first > last:
+            return []
+
+        # Centered index s holds the frequency of unshifted index (s - size // 2) % size
+        start = (first - size // 2) % size
+        stop = start + last - first + 1
+        if stop <= size:
+            return [(start, stop)]
+        return [(start, size), (0, stop - size)]
+
+    @staticmethod
+    def mirror_range(start, stop, size):
+        """
+        Map a half-open range of an unshifted axis to the range of its negated indices.
+
+        Parameters:
+        - start (int): First index of the range.
+        - stop (int): End of the range, excluded.
+        - size (int): Length of the axis.
+
+        Returns:
+        - list: Half-open (start, stop) ranges holding (-i) mod size for every index i.
+        """
+        if start > 0:
+            return [(size - stop + 1, size - start + 1)]
+        # Index 0 is its own mirror, the others wrap to the end of the axis
+        ranges = [(0, 1)]
+        if stop > 1:
+            ranges.append((size - stop + 1, size))
+        return ranges
+
+    @staticmethod
+    def merge(rectangles):
+        """
+        Split possibly overlapping rectangles into disjoint ones covering the same bins.
+
+        The rows are cut at every rectangle edge, the column ranges covering each band of
+        rows are merged, and consecutive bands with the same columns are joined again.
+
+        Parameters:
+        - rectangles (list): ((row start, row stop), (column start, column stop)) pairs.
+
+        Returns:
+        - list: Disjoint rectangles, in the same form.
+        """
+        edges = sorted({edge for rows, _ in rectangles for edge in rows})
+        merged = []
+        previous = {}
+        for top, bottom in zip(edges, edges[1:]):
+            columns = sorted(
+                columns
+                for rows, columns in rectangles
+                if rows[0] <= top and bottom <= rows[1] and columns[0] < columns[1]
+            )
+            intervals = []
+            for start, stop in columns:
+                if intervals and start <= intervals[-1][1]:
+                    intervals[-1][1] = max(intervals[-1][1], stop)
+                else:
+                    intervals.append([start, stop])
+
+            current = {}
+            for start, stop in intervals:
+                # Extend the rectangle of the band above when it has the same columns
+                index = previous.get((start, stop))
+                if index is not None and merged[index][0][1] == top:
+                    merged[index] = ((merged[index][0][0], bottom), (start, stop))
+                else:
+                    index = len(merged)
+                    merged.append(((top, bottom), (start, stop)))
+                current[(start, stop)] = index
+            previous = current
+        return merged
+
+    def get_band_slices(self, row_start, row_count):
+        """
+        Restrict the mask to a band of rows of the half-spectrum.
+
+        Parameters:
+        - row_start (int): First row of the band.
+        - row_count (int): Number of rows in the band.
+
+        Returns:
+        - list: (row slice, column slice) pairs relative to the band.
+        """
+        band_slices = []
+        for rows, columns in self.slices:
+            start = max(rows.start, row_start)
+            stop = min(rows.stop, row_start + row_count)
+            if start < stop:
+                band_slices.append(
+                    (slice(start - row_start, stop - row_start), columns)
+                )
+        return band_slices
+
+    def apply(self, spectrum, row_start=0):
+        """
+        Apply the mask to a half-spectrum, or to a band of its rows, in place.
+
+        Parameters:
+        - spectrum (numpy.ndarray): Half-spectrum of shape (height, width // 2 + 1),
+                                    or a band of its rows.
+        - row_start (int, optional): Row of the half-spectrum the band starts at. Default is 0.
+
+        Returns:
+        - numpy.ndarray: The masked spectrum (the same array).
+        """
+        regions = self.get_band_slices(row_start, spectrum.shape[0])
+
+        # inner mode
+        if self.crop_mode == 1:
+            kept = [spectrum[region].copy() for region in regions]
+            spectrum[...] = 0
+            for region, values in zip(regions, kept):
+                spectrum[region] = values
+
+        # outer mode
+        elif self.crop_mode == 2:
+            for region in regions:
+                spectrum[region] = 0
+
+        return spectrum
+
+
+@lru_cache(maxsize=32)
+def cached_mask(shape, crop_mode, dimensions):
+    return RegionMask(shape, crop_mode, dimensions)
+
+
+def get_mask(shape, crop_mode=None, dimensions=None):
+    """
+    Get the region mask for a crop, reusing it for repeated (shape, ROI, crop mode).
+
+    Parameters:
+    - shape (tuple): (height, width) of the real image.
+    - crop_mode (int): 1 for inner, 2 for outer, anything else for no crop.
+    - dimensions (list): x1,x2,y1,y2 in centered spectrum coordinates.
+
+    Returns:
+    - RegionMask or None: The mask, or None when no crop is applied.
+    """
+    if crop_mode not in (1, 2):
+        return None
+    return cached_mask(tuple(shape), crop_mode, tuple(dimensions))
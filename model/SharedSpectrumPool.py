@@ -0,0 +1,309 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from model import Precision
+from model.Mixer import MixCancelled, Mixer
+from model.SpectrumStack import SpectrumStack
+
+# Header of a result block: cancel flag and completed fraction, before the output pixels
+HEADER_SIZE = 2 * np.dtype(np.float64).itemsize
+
+# Per worker process: attached spectrum blocks and the stack built from them
+attached_blocks = {}
+cached_stack = {"names": None, "stack": None}
+
+
+def get_worker_stack(descriptors, shape):
+    """
+    Build the spectrum stack of a worker process from shared spectrum blocks.
+
+    The stack, and the components it caches, are kept until the gallery changes.
+
+    Parameters:
+    - descriptors (list): (image ID, block name, half-spectrum shape, dtype) of each spectrum.
+    - shape (tuple): (height, width) of the images.
+
+    Returns:
+    - SpectrumStack: The stack of the shared spectra.
+    """
+    names = tuple(descriptor[1] for descriptor in descriptors)
+    if cached_stack["names"] != names:
+        cached_stack["stack"] = None
+        # Detach from spectra that are no longer in the gallery
+        for name in set(attached_blocks) - set(names):
+            attached_blocks.pop(name).close()
+
+        spectra = []
+        for _, name, half_shape, dtype in descriptors:
+            if name not in attached_blocks:
+                attached_blocks[name] = shared_memory.SharedMemory(name=name)
+            spectra.append(
+                np.ndarray(half_shape, dtype=dtype, buffer=attached_blocks[name].buf)
+            )
+        cached_stack["stack"] = SpectrumStack(
+            spectra, [descriptor[0] for descriptor in descriptors], shape
+        )
+        cached_stack["names"] = names
+    return cached_stack["stack"]
+
+
+def mix_shared(descriptors, shape, result_name, weights, types, ids, crop_mode, dims):
+    """
+    Mix shared spectra in a worker process and write the output to a shared result block.
+
+    Returns:
+    - None
+    """
+    stack = get_worker_stack(descriptors, shape)
+    result_block = shared_memory.SharedMemory(name=result_name)
+    header = np.ndarray(2, dtype=np.float64, buffer=result_block.buf)
+    output = np.ndarray(
+        shape, dtype=stack.real_dtype, buffer=result_block.buf, offset=HEADER_SIZE
+    )
+
+    def progress(fraction):
+        if header[0]:
+            raise MixCancelled()
+        header[1] = fraction
+
+    error = None
+    try:
+        output[...] = Mixer(weights, types, *ids).inverse_fft(
+            stack, crop_mode, dims, progress=progress
+        )
+    except Exception as exception:
+        error = exception
+
+    # Views on the block must be gone before it can be closed
+    del header, output
+    result_block.close()
+    if error is not None:
+        raise error
+
+
+class SharedMix:
+    def __init__(self, future, block, shape, dtype):
+        """
+        Initialize a handle on a mix running in a worker process.
+
+        Parameters:
+        - future (concurrent.futures.Future): Future of the worker call.
+        - block (SharedMemory): Result block holding the header and the output pixels.
+        - shape (tuple): (height, width) of the output.
+        - dtype (numpy.dtype): Data type of the output.
+        """
+        self.future = future
+        self.block = block
+        self.header = np.ndarray(2, dtype=np.float64, buffer=block.buf)
+        self.shape = shape
+        self.dtype = dtype
+
+    def cancel(self):
+        # Checked by the worker between pipeline stages
+        self.header[0] = 1
+
+    def progress(self):
+        return float(self.header[1])
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """
+        Wait for the mix and copy the output out of the shared block.
+
+        Raises:
+        - MixCancelled: If the mix was cancelled.
+
+        Returns:
+        - numpy.ndarray: The mixed image.
+        """
+        try:
+            self.future.result(timeout)
+            output = np.ndarray(
+                self.shape, dtype=self.dtype, buffer=self.block.buf, offset=HEADER_SIZE
+            ).copy()
+        finally:
+            if self.future.done():
+                self.release()
+        return output
+
+    def release(self):
+        if self.block is not None:
+            del self.header
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+
+
+class SharedSpectrumPool:
+    def __init__(self, workers=1):
+        """
+        Initialize a pool of worker processes that mix spectra kept in shared memory.
+
+        Each spectrum is copied once into its own shared memory block when it is
+        published, normally right after its image is loaded, so mix requests only carry
+        weights, types, crop mode and ROI, and the mixing runs outside the GUI process
+        and its GIL. Mixes may be submitted from several threads, and up to one mix per
+        worker process runs at a time.
+
+        Parameters:
+        - workers (int, optional): Number of worker processes. Default is 1.
+
+        Attributes:
+        - blocks (dict): Shared block of each gallery image ID.
+        - sources (dict): Spectrum array written to each image's block.
+        - users (dict): Number of unfinished mixes reading each block, by block name.
+        - retired (dict): Blocks of replaced images still read by a mix, by block name.
+                          They are unlinked when their last mix finishes.
+        - lock (threading.RLock): Guards the blocks against concurrent publishes and submits.
+        """
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.blocks = {}
+        self.sources = {}
+        self.users = {}
+        self.retired = {}
+        self.lock = threading.RLock()
+
+    def publish(self, gallery):
+        """
+        Write the spectra of the gallery into shared memory, skipping the ones already written.
+
+        Called when images are loaded, so a mix only publishes what changed since. The
+        blocks of removed or replaced images are unlinked once no mix reads them.
+
+        Parameters:
+        - gallery (Gallery): The gallery to publish.
+
+        Returns:
+        - list: (image ID, block name, half-spectrum shape, dtype) of each spectrum.
+        """
+        with self.lock:
+            images = gallery.get_gallery()
+            for image_id in list(self.blocks):
+                if image_id not in images:
+                    self.retire(image_id)
+
+            descriptors = []
+            for image_id in sorted(images):
+                fft = images[image_id].get_fft()
+                if self.sources.get(image_id) is not fft:
+                    self.retire(image_id)
+                    block = shared_memory.SharedMemory(
+                        create=True, size=max(fft.nbytes, 1)
+                    )
+                    np.ndarray(fft.shape, dtype=fft.dtype, buffer=block.buf)[...] = fft
+                    self.blocks[image_id] = block
+                    self.sources[image_id] = fft
+                descriptors.append(
+                    (image_id, self.blocks[image_id].name, fft.shape, fft.dtype.str)
+                )
+            return descriptors
+
+    def submit(self, gallery, weights, types, ids, crop_mode=None, dimensions=None):
+        """
+        Start a mix in a worker process.
+
+        Parameters:
+        - gallery (Gallery): The gallery the images are mixed from.
+        - weights, types, ids, crop_mode, dimensions: As for Mixer and Mixer.inverse_fft.
+
+        Returns:
+        - SharedMix: Handle to follow, cancel and collect the mix.
+        """
+        with self.lock:
+            descriptors = self.publish(gallery)
+            # The blocks must outlive the mix, a worker may attach to them much later
+            names = [descriptor[1] for descriptor in descriptors]
+            for name in names:
+                self.users[name] = self.users.get(name, 0) + 1
+        shape = gallery.get_gallery()[descriptors[0][0]].shape
+        dtype = Precision.real_dtype_of(np.dtype(descriptors[0][3]))
+
+        size = HEADER_SIZE + int(np.prod(shape)) * np.dtype(dtype).itemsize
+        block = shared_memory.SharedMemory(create=True, size=size)
+        np.ndarray(2, dtype=np.float64, buffer=block.buf)[...] = 0
+
+        try:
+            future = self.executor.submit(
+                mix_shared,
+                descriptors,
+                shape,
+                block.name,
+                list(weights),
+                list(types),
+                list(ids),
+                crop_mode,
+                dimensions,
+            )
+        except BaseException:
+            block.close()
+            block.unlink()
+            self.finish(names)
+            raise
+        future.add_done_callback(lambda future: self.finish(names))
+        return SharedMix(future, block, shape, dtype)
+
+    def mix(self, gallery, weights, types, ids, crop_mode=None, dimensions=None):
+        return self.submit(gallery, weights, types, ids, crop_mode, dimensions).result()
+
+    def wait(self, handle, progress=None, interval=0.05):
+        """
+        Wait for a mix, reporting its progress while it runs.
+
+        Parameters:
+        - handle (SharedMix): The mix to wait for.
+        - progress (callable, optional): Called with the completed fraction while waiting.
+                                         It may raise MixCancelled to cancel the mix.
+        - interval (float, optional): Seconds between progress reports. Default is 0.05.
+
+        Returns:
+        - numpy.ndarray: The mixed image.
+        """
+        while not handle.done():
+            if progress is not None:
+                try:
+                    progress(handle.progress())
+                except MixCancelled:
+                    handle.cancel()
+                    break
+            time.sleep(interval)
+        return handle.result()
+
+    def retire(self, image_id):
+        # Unlink the block of an image now, or after the last mix reading it
+        block = self.blocks.pop(image_id, None)
+        self.sources.pop(image_id, None)
+        if block is None:
+            return
+        if self.users.get(block.name):
+            self.retired[block.name] = block
+        else:
+            block.close()
+            block.unlink()
+
+    def finish(self, names):
+        # Called when a mix is done, cancelled or failed
+        with self.lock:
+            for name in names:
+                self.users[name] -= 1
+                if self.users[name] == 0:
+                    del self.users[name]
+                    block = self.retired.pop(name, None)
+                    if block is not None:
+                        block.close()
+                        block.unlink()
+
+    def close(self):
+        # Every future is done after the shutdown, so every block can be unlinked
+        self.executor.shutdown(cancel_futures=True)
+        with self.lock:
+            for image_id in list(self.blocks):
+                self.retire(image_id)
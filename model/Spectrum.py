@@ -0,0 +1,275 @@
+import numpy as np
+
+from model import FFTBackend, Precision
+
+
+def half_width(width):
+    """
+    Number of columns kept by a real-input 2D Fourier Transform.
+
+    Parameters:
+    - width (int): Width of the real image.
+
+    Returns:
+    - int: Width of the non-redundant half-spectrum.
+    """
+    return width // 2 + 1
+
+
+def forward(image, out=None):
+    """
+    Compute the non-redundant half-spectrum of a real image in the current precision,
+    using the current FFT backend.
+
+    Parameters:
+    - image (numpy.ndarray): Real 2D image.
+    - out (numpy.ndarray, optional): Array of the current complex precision the
+                                     half-spectrum is written to, reused across calls.
+
+    Returns:
+    - numpy.ndarray: Complex half-spectrum of shape (height, width // 2 + 1).
+    """
+    image = np.asarray(image, dtype=Precision.real_dtype())
+    if out is not None:
+        return FFTBackend.get_backend().rfft2(image, out=out)
+    half_spectrum = FFTBackend.get_backend().rfft2(image)
+    return half_spectrum.astype(Precision.complex_dtype(), copy=False)
+
+
+def inverse(half_spectrum, shape, out=None):
+    """
+    Rebuild a real image from its half-spectrum, in the precision of the spectrum,
+    using the current FFT backend.
+
+    Parameters:
+    - half_spectrum (numpy.ndarray): Complex half-spectrum.
+    - shape (tuple): (height, width) of the image to rebuild.
+    - out (numpy.ndarray, optional): Real array of the precision of the spectrum the
+                                     image is written to, reused across calls.
+
+    Returns:
+    - numpy.ndarray: Real 2D image.
+    """
+    if out is not None:
+        return FFTBackend.get_backend().irfft2(half_spectrum, shape, out=out)
+    dtype = Precision.real_dtype_of(half_spectrum.dtype)
+    image = FFTBackend.get_backend().irfft2(half_spectrum, shape)
+    return image.astype(dtype, copy=False)
+
+
+def inverse_component(half_spectrum, component, shape):
+    """
+    Inverse transform the real part, or the imaginary part, of a half-spectrum alone.
+
+    The inverse transform is linear, so the inverse of a real/imaginary mix is the same
+    weighted sum of these images.
+
+    Parameters:
+    - half_spectrum (numpy.ndarray): Complex half-spectrum.
+    - component (str): "real" for irfft2(Re F), or "imaginary" for irfft2(j Im F).
+    - shape (tuple): (height, width) of the image to rebuild.
+
+    Returns:
+    - numpy.ndarray: Real 2D image.
+    """
+    part = np.zeros(half_spectrum.shape, dtype=half_spectrum.dtype)
+    if component == "real":
+        part.real = half_spectrum.real
+    elif component == "imaginary":
+        part.imag = half_spectrum.imag
+    else:
+        raise ValueError(f"Invalid component: {component}")
+    return inverse(part, shape)
+
+
+def band_inverse_cost(regions, shape):
+    """
+    Multiply-adds of band_inverse, to compare with the cost of a full inverse transform.
+
+    Parameters:
+    - regions (list): (row slice, column slice) pairs in half-spectrum space.
+    - shape (tuple): (height, width) of the image.
+
+    Returns:
+    - int: Estimated number of complex multiply-adds.
+    """
+    height, width = shape
+    cost = 0
+    for rows, columns in regions:
+        band_rows = rows.stop - rows.start
+        band_columns = columns.stop - columns.start
+        cost += min(
+            height * band_columns * (band_rows + width),
+            band_rows * width * (band_columns + height),
+        )
+    return cost
+
+
+def band_inverse(half_spectrum, regions, shape):
+    """
+    Inverse transform the part of a half-spectrum inside a few rectangular regions,
+    with partial DFT matrices instead of a full inverse transform.
+
+    Each region of R rows and C columns costs min(H x C x (R + W), R x W x (C + H))
+    multiply-adds, which is cheaper than a full transform for small regions.
+
+    Parameters:
+    - half_spectrum (numpy.ndarray): Complex half-spectrum.
+    - regions (list): (row slice, column slice) pairs in half-spectrum space.
+    - shape (tuple): (height, width) of the image to rebuild.
+
+    Returns:
+    - numpy.ndarray: Real 2D image, equal to the inverse of the half-spectrum zeroed
+                     outside the regions.
+    """
+    height, width = shape
+    dtype = half_spectrum.dtype
+    image = np.zeros(shape, dtype=Precision.real_dtype_of(dtype))
+    for rows, columns in regions:
+        frequencies = np.arange(rows.start, rows.stop)
+        row_basis = np.exp(
+            2j * np.pi * np.outer(np.arange(height), frequencies) / height
+        ).astype(dtype, copy=False)
+
+        # Every column of the half-spectrum stands for itself and its mirror, except
+        # the zero frequency and, for even widths, the Nyquist frequency
+        frequencies = np.arange(columns.start, columns.stop)
+        multiplicity = np.where(
+            (frequencies == 0) | (2 * frequencies == width), 1.0, 2.0
+        )
+        column_basis = (
+            multiplicity[:, None]
+            * np.exp(2j * np.pi * np.outer(frequencies, np.arange(width)) / width)
+        ).astype(dtype, copy=False)
+
+        # Multiply in the cheaper order, as counted by band_inverse_cost
+        band = half_spectrum[rows, columns]
+        band_rows, band_columns = band.shape
+        if height * band_columns * (band_rows + width) <= band_rows * width * (
+            band_columns + height
+        ):
+            image += ((row_basis @ band) @ column_basis).real
+        else:
+            image += (row_basis @ (band @ column_basis)).real
+    image /= height * width
+    return image
+
+
+def inverse_columns(strip):
+    """
+    Inverse transform the columns of a strip of a half-spectrum, the first pass of a
+    separable 2D inverse transform.
+
+    Parameters:
+    - strip (numpy.ndarray): Complex strip spanning every row of the half-spectrum.
+
+    Returns:
+    - numpy.ndarray: Complex strip of the same shape and dtype.
+    """
+    columns = FFTBackend.get_backend().ifft(strip, 0)
+    return columns.astype(strip.dtype, copy=False)
+
+
+def inverse_rows(band, width):
+    """
+    Rebuild rows of a real image from a band of column-transformed half-spectrum rows,
+    the second pass of a separable 2D inverse transform.
+
+    Parameters:
+    - band (numpy.ndarray): Complex band of half-spectrum rows, after inverse_columns.
+    - width (int): Width of the image to rebuild.
+
+    Returns:
+    - numpy.ndarray: Real band of shape (rows, width).
+    """
+    dtype = Precision.real_dtype_of(band.dtype)
+    image = FFTBackend.get_backend().irfft(band, width)
+    return image.astype(dtype, copy=False)
+
+
+def expand(half_spectrum, width):
+    """
+    Rebuild the full spectrum from a half-spectrum using Hermitian symmetry.
+
+    The missing columns satisfy F[k, l] = conj(F[-k, -l]).
+
+    Parameters:
+    - half_spectrum (numpy.ndarray): Complex half-spectrum.
+    - width (int): Width of the original real image.
+
+    Returns:
+    - numpy.ndarray: Complex full spectrum of shape (height, width).
+    """
+    height = half_spectrum.shape[0]
+    full = np.empty((height, width), dtype=half_spectrum.dtype)
+    kept = half_width(width)
+    full[:, :kept] = half_spectrum
+
+    # Mirror rows (k -> -k) and columns (l -> -l) for the missing part
+    rows = (-np.arange(height)) % height
+    columns = (-np.arange(kept, width)) % width
+    full[:, kept:] = np.conj(half_spectrum[rows][:, columns])
+    return full
+
+
+def expand_shifted(half_spectrum, width):
+    """
+    Rebuild the full spectrum with the zero-frequency component in the center.
+
+    Parameters:
+    - half_spectrum (numpy.ndarray): Complex half-spectrum.
+    - width (int): Width of the original real image.
+
+    Returns:
+    - numpy.ndarray: Centered complex full spectrum of shape (height, width).
+    """
+    return np.fft.fftshift(expand(half_spectrum, width))
+
+
+def crop_low_frequencies(half_spectrum, shape, new_shape):
+    """
+    Keep only the low frequencies of a half-spectrum, so its inverse is a smaller
+    version of the image.
+
+    The values are rescaled so the smaller image keeps the same intensities.
+    Works on the last two axes, so a stack of half-spectra can be cropped at once.
+
+    Parameters:
+    - half_spectrum (numpy.ndarray): Complex half-spectrum of an image of the given shape.
+    - shape (tuple): (height, width) of the image.
+    - new_shape (tuple): (height, width) of the smaller image, at most the image shape.
+
+    Returns:
+    - numpy.ndarray: Complex half-spectrum of shape (new height, new width // 2 + 1).
+    """
+    height, width = shape
+    new_height, new_width = new_shape
+    kept = half_width(new_width)
+
+    # Unshifted rows hold the positive frequencies first and the negative ones last
+    negative = new_height // 2
+    rows = [half_spectrum[..., : new_height - negative, :kept]]
+    if negative:
+        rows.append(half_spectrum[..., height - negative :, :kept])
+    cropped = np.concatenate(rows, axis=-2)
+    cropped *= (new_height * new_width) / (height * width)
+    return cropped
+
+
+def crop_dimensions(dimensions, shape, new_shape):
+    """
+    Map a region drawn on the centered spectrum of an image to the centered spectrum
+    of its low-frequency crop.
+
+    Parameters:
+    - dimensions (list): x1,x2,y1,y2 on the centered spectrum of the image.
+    - shape (tuple): (height, width) of the image.
+    - new_shape (tuple): (height, width) of the cropped spectrum's image.
+
+    Returns:
+    - list: x1,x2,y1,y2 on the centered cropped spectrum.
+    """
+    x_offset = new_shape[1] // 2 - shape[1] // 2
+    y_offset = new_shape[0] // 2 - shape[0] // 2
+    x1, x2, y1, y2 = dimensions
+    return [x1 + x_offset, x2 + x_offset, y1 + y_offset, y2 + y_offset]
@@ -0,0 +1,121 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SpectrumCache:
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        """
+        Initialize a least-recently-used cache of image spectra.
+
+        Spectra are keyed by (file content hash, target shape, dtype), so the same
+        file loaded into another slot, or transformed again at the same size, reuses
+        the stored spectrum instead of running the FFT again.
+
+        Parameters:
+        - max_bytes (int, optional): Memory budget of the cache in bytes.
+                                     Default is 512 MiB.
+
+        Attributes:
+        - max_bytes (int): Memory budget of the cache in bytes.
+        - entries (OrderedDict): Cached spectra, least recently used first.
+        - size (int): Total number of bytes currently held by the cache.
+        - hits (int): Number of lookups answered from the cache.
+        - misses (int): Number of lookups that were not in the cache.
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(content_hash, shape, dtype):
+        """
+        Build the cache key of a spectrum.
+
+        Parameters:
+        - content_hash (str): Hash of the source file content.
+        - shape (tuple): Shape of the transformed image.
+        - dtype (numpy.dtype or str): Data type of the spectrum.
+
+        Returns:
+        - tuple: The cache key.
+        """
+        return (content_hash, tuple(shape), np.dtype(dtype).name)
+
+    def get(self, key):
+        """
+        Look up a spectrum and mark it as recently used.
+
+        Parameters:
+        - key (tuple): Key built with make_key.
+
+        Returns:
+        - numpy.ndarray or None: The cached spectrum, or None if it is not cached.
+        """
+        with self.lock:
+            spectrum = self.entries.get(key)
+            if spectrum is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return spectrum
+
+    def put(self, key, spectrum):
+        """
+        Store a spectrum, evicting the least recently used ones to stay within budget.
+
+        The stored array is made read-only because it is shared between images.
+
+        Parameters:
+        - key (tuple): Key built with make_key.
+        - spectrum (numpy.ndarray): The spectrum to store.
+
+        Returns:
+        - None
+        """
+        if spectrum.nbytes > self.max_bytes:
+            return
+        spectrum.flags.writeable = False
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key).nbytes
+            self.entries[key] = spectrum
+            self.size += spectrum.nbytes
+            self.evict()
+
+    def evict(self):
+        # Drop least recently used entries until the budget is met
+        while self.size > self.max_bytes and self.entries:
+            _, spectrum = self.entries.popitem(last=False)
+            self.size -= spectrum.nbytes
+
+    def set_max_bytes(self, max_bytes):
+        """
+        Change the memory budget, evicting entries if the cache is now too large.
+
+        Parameters:
+        - max_bytes (int): New memory budget in bytes.
+
+        Returns:
+        - None
+        """
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+# Cache shared by every Image, its budget can be set with IMAGE_MIXER_SPECTRUM_CACHE_MB
+shared_cache = SpectrumCache(
+    int(float(os.environ.get("IMAGE_MIXER_SPECTRUM_CACHE_MB", 512)) * 1024 * 1024)
+)
@@ -0,0 +1,426 @@
+import threading
+
+import numpy as np
+
+from model import Precision, Spectrum
+
+# Incremental updates of a cached sum before it is recomputed, bounding rounding drift
+REFRESH_UPDATES = 16
+
+
+class SpectrumStack:
+    def __init__(self, spectra, keys, shape, inverse_sources=None):
+        """
+        Initialize a stacked tensor of half-spectra so mixes can be computed as
+        weight-vector contractions.
+
+        Component stacks are computed from the individual spectra, so the complex tensor
+        itself is only built when it is needed. Spectra memory-mapped from the spectrum
+        store are read in place: their real and imaginary parts are summed straight from
+        the mapped files instead of being copied into a tensor.
+
+        Parameters:
+        - spectra (list or numpy.ndarray): Half-spectra of the images, all with the same shape,
+                                           or an already stacked tensor, which is used without a copy.
+        - keys (list): Key of each spectrum (e.g. its gallery ID), in the same order.
+        - shape (tuple): (height, width) of the images the spectra come from.
+        - inverse_sources (list, optional): For each spectrum, an object with get_inverse(component)
+                                            and has_inverse(component), such as its Image, holding
+                                            precomputed inverse transforms of its real and imaginary
+                                            parts. Default computes them from the spectra when needed.
+
+        Attributes:
+        - sources (list): The half-spectrum of each image.
+        - shape (tuple): (height, width) of the images.
+        - half_shape (tuple): Shape of each half-spectrum.
+        - dtype (numpy.dtype): Complex dtype of the spectra.
+        - real_dtype (numpy.dtype): Real dtype matching the precision of the spectra.
+        - index (dict): Maps each key to its position in the tensor.
+        - components (dict): Cached component stacks, computed the first time they are read.
+        - previews (dict): Cached low-resolution stacks, keyed by their largest side.
+        - sums (dict): Last weights and weighted sum of each component, updated by delta.
+        - remix (tuple): Last real/imaginary weights, region mask key and unclipped output.
+        - full_inverses (dict): Inverse transforms of the real and imaginary parts alone, by
+                                (component, position), when there are no inverse sources.
+        - inverses (dict): Inverse transform of one masked component of one spectrum, by
+                           (component, position), for the region mask of inverses_key.
+        """
+        self.stacked = spectra if isinstance(spectra, np.ndarray) else None
+        self.sources = list(spectra)
+        self.shape = tuple(shape)
+        self.half_shape = self.sources[0].shape
+        self.dtype = np.result_type(*self.sources)
+        self.real_dtype = Precision.real_dtype_of(self.dtype)
+        self.index = {key: i for i, key in enumerate(keys)}
+        self.components = {}
+        self.previews = {}
+        self.sums = {}
+        self.remix = None
+        self.inverse_sources = inverse_sources
+        self.full_inverses = {}
+        self.inverses = {}
+        self.inverses_key = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sources)
+
+    @property
+    def spectra(self):
+        """
+        Complex tensor of shape (n, height, width // 2 + 1), stacked on first use.
+        """
+        if self.stacked is None:
+            self.stacked = np.stack(self.sources)
+        return self.stacked
+
+    def is_mapped(self):
+        return self.stacked is None and any(
+            isinstance(source, np.memmap) for source in self.sources
+        )
+
+    def get_component(self, component):
+        """
+        Get a component of every spectrum in the stack, computing and caching it on first use.
+
+        Parameters:
+        - component (str): One of "magnitude", "phase", "real" or "imaginary".
+
+        Returns:
+        - numpy.ndarray: Tensor of shape (n, height, width // 2 + 1).
+        """
+        if component not in self.components:
+            if component == "magnitude":
+                stack = np.empty((len(self),) + self.half_shape, dtype=self.real_dtype)
+                for source, magnitude in zip(self.sources, stack):
+                    np.abs(source, out=magnitude)
+                self.components[component] = stack
+            elif component == "phase":
+                stack = np.empty((len(self),) + self.half_shape, dtype=self.real_dtype)
+                for source, phase in zip(self.sources, stack):
+                    phase[...] = np.angle(source)
+                self.components[component] = stack
+            elif component == "real":
+                self.components[component] = self.spectra.real
+            elif component == "imaginary":
+                self.components[component] = self.spectra.imag
+            else:
+                raise ValueError(f"Invalid component: {component}")
+        return self.components[component]
+
+    def get_source_component(self, component, position):
+        if component in ("real", "imaginary") and self.is_mapped():
+            source = self.sources[position]
+            return source.real if component == "real" else source.imag
+        return self.get_component(component)[position]
+
+    def weighted_sum(self, component, weights):
+        """
+        Contract a component stack with a weight vector.
+
+        The last sum of each component is kept with its weights. When only some weights
+        changed, the new sum is the last one plus the contributions of the changed
+        spectra, one array update each. Cached sums are never modified in place.
+
+        Parameters:
+        - component (str): One of "magnitude", "phase", "real" or "imaginary".
+        - weights (numpy.ndarray): One weight per spectrum in the stack.
+
+        Returns:
+        - numpy.ndarray: Weighted sum of shape (height, width // 2 + 1).
+        """
+        with self.lock:
+            previous = self.sums.get(component)
+
+        if previous is not None:
+            last_weights, last_total, updates = previous
+            changed = np.flatnonzero(weights != last_weights)
+            if len(changed) == 0:
+                return last_total
+            if len(changed) < len(self) and updates < REFRESH_UPDATES:
+                total = last_total.copy()
+                term = np.empty_like(total)
+                for position in changed:
+                    np.multiply(
+                        self.get_source_component(component, position),
+                        weights[position] - last_weights[position],
+                        out=term,
+                    )
+                    total += term
+                with self.lock:
+                    self.sums[component] = (weights.copy(), total, updates + 1)
+                return total
+
+        if component in ("real", "imaginary") and self.is_mapped():
+            # Sum straight from the mapped spectra, without stacking them in memory
+            total = self.weighted_rows(component, weights, 0, self.half_shape[0])
+        else:
+            total = np.tensordot(weights, self.get_component(component), axes=1)
+        with self.lock:
+            self.sums[component] = (weights.copy(), total, 0)
+        return total
+
+    def get_full_inverse(self, component, position):
+        if self.inverse_sources is not None:
+            return self.inverse_sources[position].get_inverse(component)
+        key = (component, position)
+        if key not in self.full_inverses:
+            self.full_inverses[key] = Spectrum.inverse_component(
+                self.sources[position], component, self.shape
+            )
+        return self.full_inverses[key]
+
+    def has_full_inverse(self, component, position):
+        if self.inverse_sources is not None:
+            return self.inverse_sources[position].has_inverse(component)
+        return (component, position) in self.full_inverses
+
+    def is_band_cheap(self, mask):
+        # Partial DFTs of the region against one full inverse transform, with a margin
+        # for building the DFT matrices
+        height, width = self.shape
+        transform_cost = height * width * max(np.log2(height * width), 1)
+        return Spectrum.band_inverse_cost(mask.slices, self.shape) <= transform_cost / 2
+
+    def has_inverse(self, component, position, mask):
+        """
+        Whether get_inverse already holds the inverse of a component, without computing it.
+        """
+        if mask is None:
+            return self.has_full_inverse(component, position)
+        return (component, position) in self.inverses
+
+    def needs_transform(self, component, position, mask):
+        """
+        Whether get_inverse has to run a full inverse transform for a component.
+        """
+        if mask is None:
+            return not self.has_full_inverse(component, position)
+        if (component, position) in self.inverses:
+            return False
+        if not self.is_band_cheap(mask):
+            return True
+        return mask.crop_mode == 2 and not self.has_full_inverse(component, position)
+
+    def get_inverse(self, component, position, mask):
+        """
+        Get the inverse transform of one masked component of one spectrum, computing and
+        caching it on first use.
+
+        Without a mask, it is the precomputed inverse of the component. With a mask, the
+        contribution of the region (the band) is computed with partial DFTs when the region
+        is small enough, or else with one inverse transform. An inner crop keeps the band,
+        and an outer crop is the precomputed inverse minus the band.
+
+        Parameters:
+        - component (str): "real" or "imaginary".
+        - position (int): Position of the spectrum in the stack.
+        - mask (RegionMask or None): The region mask applied before the inverse transform,
+                                     the one of inverses_key.
+
+        Returns:
+        - numpy.ndarray: Real image, the contribution of the component with weight 1.
+        """
+        if mask is None:
+            return self.get_full_inverse(component, position)
+
+        key = (component, position)
+        if key not in self.inverses:
+            source = self.sources[position]
+            spectrum = np.zeros(self.half_shape, dtype=self.dtype)
+            if self.is_band_cheap(mask):
+                for region in mask.slices:
+                    if component == "real":
+                        spectrum[region].real = source[region].real
+                    else:
+                        spectrum[region].imag = source[region].imag
+                band = Spectrum.band_inverse(spectrum, mask.slices, self.shape)
+                if mask.crop_mode == 1:
+                    self.inverses[key] = band
+                else:
+                    self.inverses[key] = (
+                        self.get_full_inverse(component, position) - band
+                    )
+            else:
+                if component == "real":
+                    spectrum.real = source.real
+                else:
+                    spectrum.imag = source.imag
+                mask.apply(spectrum)
+                self.inverses[key] = Spectrum.inverse(spectrum, self.shape)
+        return self.inverses[key]
+
+    def use_mask(self, mask_key):
+        # Masked inverses are only kept for the current region mask
+        if self.inverses_key != mask_key:
+            self.inverses = {}
+            self.inverses_key = mask_key
+
+    def remix_inverse(self, weights, mask):
+        """
+        Mix the real and imaginary parts in image space, without a full inverse transform.
+
+        The inverse transform is linear, so a real/imaginary mix is the weighted sum of the
+        inverse transforms of each masked component alone (see get_inverse). Without a crop
+        these are precomputed, and with a crop they are cached for the current region
+        mask, so a mix is a few array updates. When the last mix had the same mask, only
+        the changed weights are applied to its output. At most one full inverse transform
+        is run here, beyond that a mix in the frequency domain is cheaper. When the spectra
+        are memory-mapped from the spectrum store, only inverses already held are used:
+        no full or band inverse is computed or cached, so no new full-size inverse is
+        kept in RAM.
+
+        Parameters:
+        - weights (dict): Weight vector of "real" and of "imaginary".
+        - mask (RegionMask or None): The region mask of the mix.
+
+        Returns:
+        - numpy.ndarray or None: The unclipped output, or None if a full mix is needed.
+        """
+        mask_key = None if mask is None else mask.get_key()
+        with self.lock:
+            self.use_mask(mask_key)
+            remix = self.remix
+            if (
+                remix is not None
+                and remix[1] == mask_key
+                and remix[3] < REFRESH_UPDATES
+            ):
+                last_weights, _, last_output, updates = remix
+            else:
+                last_weights = {
+                    component: np.zeros(len(self), dtype=self.real_dtype)
+                    for component in weights
+                }
+                last_output, updates = None, -1
+
+            changes = [
+                (component, position, weights[component][position] - last_weight)
+                for component, vector in last_weights.items()
+                for position, last_weight in enumerate(vector)
+                if weights[component][position] != last_weight
+            ]
+            if any(isinstance(source, np.memmap) for source in self.sources):
+                # Memory-mapped spectra must not gain resident full-size inverses,
+                # transformed or band ones
+                held = all(
+                    self.has_inverse(component, position, mask)
+                    for component, position, _ in changes
+                )
+                if not held:
+                    return None
+            else:
+                transforms = sum(
+                    self.needs_transform(component, position, mask)
+                    for component, position, _ in changes
+                )
+                if transforms > 1:
+                    return None
+
+            if last_output is None:
+                output = np.zeros(self.shape, dtype=self.real_dtype)
+            elif not changes:
+                return last_output
+            else:
+                output = last_output.copy()
+            for component, position, delta in changes:
+                output += delta * self.get_inverse(component, position, mask)
+            self.remix = (
+                {component: vector.copy() for component, vector in weights.items()},
+                mask_key,
+                output,
+                updates + 1,
+            )
+        return output
+
+    def remember_inverse(self, weights, mask, output):
+        """
+        Keep the unclipped output of a full real/imaginary mix for later remix_inverse calls.
+
+        Parameters:
+        - weights (dict): Weight vector of "real" and of "imaginary".
+        - mask (RegionMask or None): The region mask of the mix.
+        - output (numpy.ndarray): The unclipped output of the mix.
+
+        Returns:
+        - None
+        """
+        mask_key = None if mask is None else mask.get_key()
+        with self.lock:
+            self.use_mask(mask_key)
+            self.remix = (
+                {component: vector.copy() for component, vector in weights.items()},
+                mask_key,
+                output,
+                0,
+            )
+
+    def weighted_rows(self, component, weights, start, stop):
+        """
+        Contract a band of rows of a component with a weight vector, reading only those
+        rows of each spectrum and without caching any component stack.
+
+        Parameters:
+        - component (str): One of "magnitude", "phase", "real" or "imaginary".
+        - weights (numpy.ndarray): One weight per spectrum in the stack.
+        - start (int): First row of the band.
+        - stop (int): Row after the last row of the band.
+
+        Returns:
+        - numpy.ndarray: Weighted sum of shape (stop - start, width // 2 + 1).
+        """
+        total = np.zeros((stop - start, self.half_shape[1]), dtype=self.real_dtype)
+        term = np.empty_like(total)
+        for weight, source in zip(weights, self.sources):
+            if not weight:
+                continue
+            rows = source[start:stop]
+            if component == "magnitude":
+                np.abs(rows, out=term)
+            elif component == "phase":
+                term[...] = np.angle(rows)
+            elif component == "real":
+                term[...] = rows.real
+            elif component == "imaginary":
+                term[...] = rows.imag
+            else:
+                raise ValueError(f"Invalid component: {component}")
+            term *= weight
+            total += term
+        return total
+
+    def get_preview(self, max_size):
+        """
+        Get a low-resolution version of the stack for fast previews, computing and caching
+        it on first use.
+
+        The preview keeps only the low frequencies of each spectrum, so mixing it gives a
+        downsampled version of the full-resolution mix.
+
+        Parameters:
+        - max_size (int): Largest side of the preview images.
+
+        Returns:
+        - SpectrumStack: The preview stack, or this stack if it is already small enough.
+        """
+        height, width = self.shape
+        if max(height, width) <= max_size:
+            return self
+
+        if max_size not in self.previews:
+            scale = max_size / max(height, width)
+            preview_shape = (
+                max(1, round(height * scale)),
+                max(1, round(width * scale)),
+            )
+            self.previews[max_size] = SpectrumStack(
+                np.stack(
+                    [
+                        Spectrum.crop_low_frequencies(source, self.shape, preview_shape)
+                        for source in self.sources
+                    ]
+                ),
+                list(self.index),
+                preview_shape,
+            )
+        return self.previews[max_size]
@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class SpectrumStore:
+    def __init__(self, directory):
+        """
+        Initialize an on-disk store of image spectra.
+
+        Each spectrum is written once to a .npy file, with a .json file holding its shape,
+        dtype and source hash, and is then re-opened as a read-only memory map. Large
+        spectra therefore stay on disk instead of in RAM, and restarting the application
+        with the same images reuses the stored spectra instead of recomputing them.
+
+        Parameters:
+        - directory (str): Directory holding the stored spectra. Created if missing.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, key):
+        content_hash, shape, dtype = key
+        name = f"{content_hash}_{shape[0]}x{shape[1]}_{dtype}"
+        return os.path.join(self.directory, name)
+
+    def load(self, key):
+        """
+        Open a stored spectrum as a read-only memory map.
+
+        Parameters:
+        - key (tuple): Key built with SpectrumCache.make_key.
+
+        Returns:
+        - numpy.memmap or None: The stored spectrum, or None if it is not stored.
+        """
+        path = self.get_path(key)
+        try:
+            with open(path + ".json") as metadata_file:
+                metadata = json.load(metadata_file)
+            spectrum = np.load(path + ".npy", mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
+        content_hash, shape, dtype = key
+        if (
+            metadata["source_hash"] != content_hash
+            or tuple(metadata["image_shape"]) != tuple(shape)
+            or metadata["dtype"] != dtype
+            or tuple(metadata["shape"]) != spectrum.shape
+        ):
+            return None
+        return spectrum
+
+    def save(self, key, spectrum):
+        """
+        Write a spectrum to the store and re-open it as a read-only memory map.
+
+        The files are written under temporary names, unique to the process and thread,
+        and renamed, so an interrupted or concurrent write never leaves a partial
+        spectrum behind.
+
+        Parameters:
+        - key (tuple): Key built with SpectrumCache.make_key.
+        - spectrum (numpy.ndarray): The spectrum to store.
+
+        Returns:
+        - numpy.memmap: The stored spectrum.
+        """
+        path = self.get_path(key)
+        content_hash, shape, dtype = key
+        metadata = {
+            "source_hash": content_hash,
+            "image_shape": list(shape),
+            "dtype": dtype,
+            "shape": list(spectrum.shape),
+        }
+
+        # Spectra are saved from the loader threads, so the name is unique per thread
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary + ".npy", "wb") as spectrum_file:
+            np.save(spectrum_file, spectrum)
+        with open(temporary + ".json", "w") as metadata_file:
+            json.dump(metadata, metadata_file)
+        os.replace(temporary + ".npy", path + ".npy")
+        os.replace(temporary + ".json", path + ".json")
+
+        return np.load(path + ".npy", mmap_mode="r")
+
+
+# Store shared by every Image, enabled by setting IMAGE_MIXER_SPECTRUM_STORE to a directory
+shared_store = (
+    SpectrumStore(os.environ["IMAGE_MIXER_SPECTRUM_STORE"])
+    if os.environ.get("IMAGE_MIXER_SPECTRUM_STORE")
+    else None
+)
+
+
+def set_store(directory):
+    """
+    Enable the shared spectrum store in a directory, or disable it.
+
+    Parameters:
+    - directory (str or None): Directory of the store, or None to disable it.
+
+    Returns:
+    - None
+    """
+    global shared_store
+    shared_store = SpectrumStore(directory) if directory else None
@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip("cv2")
+
+from batch_mix import read_manifest
+
+
+def test_malformed_lines_are_reported_per_line(tmp_path):
+    manifest = tmp_path / "jobs.jsonl"
+    manifest.write_text(
+        '{"images": ["a.png"], "output": "a.png"}\n'
+        "# comment\n"
+        '{"images": [broken\n'
+        "[1, 2]\n"
+        "\n"
+        '{"images": ["b.png"], "output": "b.png"}\n'
+    )
+
+    jobs = list(read_manifest(str(manifest)))
+    assert [line_number for line_number, _ in jobs] == [1, 3, 4, 6]
+    assert jobs[0][1]["output"] == "a.png"
+    assert isinstance(jobs[1][1], ValueError)
+    assert isinstance(jobs[2][1], ValueError)
+    assert jobs[3][1]["output"] == "b.png"
@@ -0,0 +1,60 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from model import Instrumentation
+
+
+@pytest.fixture
+def tracing():
+    enabled = Instrumentation.is_enabled()
+    Instrumentation.set_enabled(True)
+    Instrumentation.clear()
+    yield
+    Instrumentation.clear()
+    Instrumentation.set_enabled(enabled)
+
+
+def recorded():
+    return {event["name"]: event["args"] for event in Instrumentation.events}
+
+
+def test_single_thread_stages_record_their_peak(tracing):
+    with Instrumentation.stage("outer"):
+        kept = np.ones(2**20)
+        with Instrumentation.stage("inner"):
+            np.ones(2**19)
+
+    stages = recorded()
+    assert stages["inner"]["allocated_bytes"] >= 2**19 * 8
+    assert stages["outer"]["allocated_bytes"] >= (2**20 + 2**19) * 8
+    assert "overlapped" not in stages["outer"]
+    del kept
+
+
+def test_overlapping_stages_are_flagged(tracing):
+    barrier = threading.Barrier(2)
+
+    def work(name):
+        with Instrumentation.stage(name):
+            barrier.wait()
+            np.ones(2**20)
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=work, args=(name,)) for name in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stages = recorded()
+    for name in ("a", "b"):
+        assert stages[name]["allocated_bytes"] is None
+        assert stages[name]["overlapped"]
+
+    # Later stages are measured again
+    with Instrumentation.stage("after"):
+        np.ones(2**20)
+    assert recorded()["after"]["allocated_bytes"] >= 2**20 * 8
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from model.Image import Image
+from model.Mixer import Mixer
+
+SHAPES = [(40, 48), (37, 52), (44, 29), (31, 45)]
+TYPES = {
+    "magnitude/phase": ["magnitude", "phase", "phase", "magnitude"],
+    "real/imaginary": ["real", "imaginary", "imaginary", "real"],
+}
+CROPS = [(0, None), (1, [10, 30, 5, 25]), (2, [10, 30, 5, 25])]
+
+
+def make_images(shape, seed):
+    rng = np.random.default_rng(seed)
+    images = {}
+    for image_id in range(4):
+        images[image_id] = Image()
+        images[image_id].set_image(rng.random(shape) * 255)
+        images[image_id].compute_fourier_transform()
+    return images
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("types", TYPES.values(), ids=TYPES.keys())
+@pytest.mark.parametrize("crop_mode, dimensions", CROPS)
+def test_tiled_matches_inverse_fft(shape, types, crop_mode, dimensions):
+    images = make_images(shape, sum(shape))
+    mixer = Mixer([0.5, 1, 0.3, 0.8], types, 0, 1, 2, 3)
+
+    expected = mixer.inverse_fft(images, crop_mode, dimensions)
+    # A budget of a few rows forces many bands and strips
+    output = mixer.inverse_fft_tiled(images, crop_mode, dimensions, budget_mb=0.002)
+    np.testing.assert_allclose(output, expected, atol=1e-9)
+
+
+def test_tiled_writes_to_memory_map(tmp_path):
+    shape = (37, 52)
+    images = make_images(shape, 5)
+    mixer = Mixer([1, 1, 0, 0], TYPES["magnitude/phase"], 0, 1, 2, 3)
+
+    output = np.memmap(tmp_path / "output", dtype=np.float64, mode="w+", shape=shape)
+    result = mixer.inverse_fft_tiled(images, budget_mb=0.002, output=output)
+    assert result is output
+    np.testing.assert_allclose(output, mixer.inverse_fft(images), atol=1e-9)
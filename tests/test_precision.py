@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from model import Precision
+from model.Image import Image
+from model.Mixer import Mixer
+
+SHAPES = [(256, 256), (255, 301)]
+TYPES = {
+    "magnitude/phase": ["magnitude", "phase", "phase", "magnitude"],
+    "real/imaginary": ["real", "imaginary", "imaginary", "real"],
+}
+CROPS = [(0, None), (1, [100, 160, 90, 150]), (2, [100, 160, 90, 150])]
+# Documented bound of single against double precision, in gray levels
+MAX_ERROR = 0.05
+
+
+@pytest.fixture
+def restore_precision():
+    precision = Precision.get_precision()
+    yield
+    Precision.set_precision(precision)
+
+
+def mix(pixels, precision, types, crop_mode, dimensions):
+    Precision.set_precision(precision)
+    images = {}
+    for image_id, image_pixels in enumerate(pixels):
+        images[image_id] = Image()
+        images[image_id].set_image(image_pixels)
+        images[image_id].compute_fourier_transform()
+    mixer = Mixer([0.5, 1, 0.3, 0.8], types, 0, 1, 2, 3)
+    return mixer.inverse_fft(images, crop_mode, dimensions)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("types", TYPES.values(), ids=TYPES.keys())
+@pytest.mark.parametrize("crop_mode, dimensions", CROPS)
+def test_single_precision_error_bound(
+    restore_precision, shape, types, crop_mode, dimensions
+):
+    # 8-bit inputs, as loaded from image files
+    rng = np.random.default_rng(sum(shape))
+    pixels = [rng.integers(0, 256, shape).astype(np.float32) for _ in range(4)]
+
+    double = mix(pixels, "double", types, crop_mode, dimensions)
+    single = mix(pixels, "single", types, crop_mode, dimensions)
+    assert double.dtype == np.float64 and single.dtype == np.float32
+    assert np.abs(single.astype(np.float64) - double).max() < MAX_ERROR
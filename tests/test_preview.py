@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from model import RegionMask, Spectrum
+from model.Gallery import Gallery
+from model.Image import Image
+from model.Mixer import Mixer
+
+SHAPES = [(120, 160), (121, 97)]
+TYPES = {
+    "magnitude/phase": ["magnitude", "phase", "phase", "magnitude"],
+    "real/imaginary": ["real", "imaginary", "imaginary", "real"],
+}
+PREVIEW_SIZE = 48
+
+
+def make_gallery(shape, seed):
+    rng = np.random.default_rng(seed)
+    gallery = Gallery()
+    for image_id in range(4):
+        image = Image()
+        image.set_image(rng.random(shape) * 255)
+        image.compute_fourier_transform()
+        gallery.add_image(image, image_id)
+    return gallery
+
+
+def centered_region(shape, size):
+    # A region around the zero frequency, which the preview keeps
+    height, width = shape
+    return [
+        width // 2 - size,
+        width // 2 + size,
+        height // 2 - size,
+        height // 2 + size,
+    ]
+
+
+def downscaled_mix(mixer, stack, crop_mode, dimensions, preview_shape):
+    """
+    Mix at full resolution, then keep the low frequencies of the mixed spectrum.
+
+    Returns:
+    - numpy.ndarray: The full mix downscaled to the preview shape, clipped as inverse_fft.
+    """
+    spectrum = np.empty(stack.half_shape, dtype=stack.dtype)
+    mixer.mix_spectrum(stack, mixer.choose_mode(), spectrum)
+    mask = RegionMask.get_mask(stack.shape, crop_mode, dimensions)
+    if mask is not None:
+        mask.apply(spectrum)
+    cropped = Spectrum.crop_low_frequencies(spectrum, stack.shape, preview_shape)
+    return np.clip(np.abs(Spectrum.inverse(cropped, preview_shape)), 0, 225)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("types", TYPES.values(), ids=TYPES.keys())
+@pytest.mark.parametrize("crop_mode", [0, 1, 2])
+def test_preview_matches_downscaled_full_mix(shape, types, crop_mode):
+    gallery = make_gallery(shape, sum(shape))
+    stack = gallery.get_stack()
+    dimensions = centered_region(shape, 10) if crop_mode else None
+    mixer = Mixer([0.5, 1, 0.3, 0.8], types, 0, 1, 2, 3)
+
+    preview = mixer.inverse_fft(
+        gallery, crop_mode, dimensions, preview_size=PREVIEW_SIZE
+    )
+    assert max(preview.shape) == PREVIEW_SIZE
+    expected = downscaled_mix(mixer, stack, crop_mode, dimensions, preview.shape)
+    np.testing.assert_allclose(preview, expected, atol=1e-9)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_crop_dimensions_keeps_the_region(shape):
+    preview_shape = (shape[0] * 2 // 5, shape[1] * 2 // 5)
+    dimensions = centered_region(shape, 6)
+    mask = RegionMask.get_mask(shape, 1, dimensions)
+    preview_mask = RegionMask.get_mask(
+        preview_shape, 1, Spectrum.crop_dimensions(dimensions, shape, preview_shape)
+    )
+
+    # Cropping the masked spectrum, or masking the cropped one, keeps the same values
+    half_shape = (shape[0], Spectrum.half_width(shape[1]))
+    ones = np.ones(half_shape, dtype=complex)
+    np.testing.assert_array_equal(
+        Spectrum.crop_low_frequencies(mask.apply(ones.copy()), shape, preview_shape),
+        preview_mask.apply(Spectrum.crop_low_frequencies(ones, shape, preview_shape)),
+    )
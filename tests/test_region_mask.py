@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from model import RegionMask, Spectrum
+from model.Image import Image
+from model.Mixer import Mixer
+
+
+def reference_crop(image, crop_mode, dimensions):
+    """
+    Crop the full fft2 spectrum of an image on the region and its Hermitian mirror.
+
+    Parameters:
+    - image (numpy.ndarray): Real 2D image.
+    - crop_mode (int): 1 for inner, 2 for outer.
+    - dimensions (list): x1,x2,y1,y2 in centered spectrum coordinates, inclusive.
+
+    Returns:
+    - numpy.ndarray: Inverse of the cropped spectrum.
+    """
+    height, width = image.shape
+    x1, x2, y1, y2 = dimensions
+    centered = np.zeros(image.shape, dtype=bool)
+    centered[max(y1, 0) : y2 + 1, max(x1, 0) : x2 + 1] = True
+    region = np.fft.ifftshift(centered)
+    rows = (-np.arange(height)) % height
+    columns = (-np.arange(width)) % width
+    region |= region[rows][:, columns]
+    if crop_mode == 2:
+        region = ~region
+
+    inverse = np.fft.ifft2(np.fft.fft2(image) * region)
+    assert np.abs(inverse.imag).max() < 1e-9
+    return inverse.real
+
+
+SHAPES = [(250, 250), (64, 96), (63, 95), (80, 51)]
+REGIONS = [
+    # Left half of the centered spectrum, dropped by the real-input transform
+    lambda height, width: [10, width // 3, 10, height // 3],
+    # Off-center, crossing the middle column
+    lambda height, width: [width // 2 - 7, width // 2 + 12, 3, height // 2 + 4],
+    # Right half, wrapping around no edge
+    lambda height, width: [width // 2 + 3, width - 5, height // 2 + 2, height - 1],
+    # Around the zero frequency
+    lambda height, width: [
+        width // 2 - 4,
+        width // 2 + 4,
+        height // 2 - 4,
+        height // 2 + 4,
+    ],
+    # Default ROI of the application
+    lambda height, width: [0, 50, 0, 50],
+]
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("region", REGIONS)
+@pytest.mark.parametrize("crop_mode", [1, 2])
+def test_mask_matches_full_spectrum(shape, region, crop_mode):
+    image = np.random.default_rng(0).random(shape) * 255
+    dimensions = region(*shape)
+    mask = RegionMask.get_mask(shape, crop_mode, dimensions)
+    assert mask.slices
+
+    half_spectrum = mask.apply(np.fft.rfft2(image))
+    output = np.fft.irfft2(half_spectrum, s=shape)
+    np.testing.assert_allclose(
+        output, reference_crop(image, crop_mode, dimensions), atol=1e-9
+    )
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("region", REGIONS)
+def test_slices_are_disjoint_for_band_inverse(shape, region):
+    image = np.random.default_rng(1).random(shape) * 255
+    dimensions = region(*shape)
+    mask = RegionMask.get_mask(shape, 1, dimensions)
+
+    covered = np.zeros((shape[0], Spectrum.half_width(shape[1])), dtype=int)
+    for region_slices in mask.slices:
+        covered[region_slices] += 1
+    assert covered.max() == 1
+
+    band = Spectrum.band_inverse(np.fft.rfft2(image), mask.slices, shape)
+    np.testing.assert_allclose(band, reference_crop(image, 1, dimensions), atol=1e-8)
+
+
+def test_left_half_crop_in_mixer():
+    shape = (250, 250)
+    image = Image()
+    image.set_image(np.random.default_rng(2).random(shape) * 255)
+    image.compute_fourier_transform()
+    dimensions = [10, 100, 10, 100]
+    mixer = Mixer([1, 1, 0, 0], ["real", "imaginary", "real", "imaginary"], 0, 0, 0, 0)
+
+    for crop_mode in (1, 2):
+        output = mixer.inverse_fft({0: image}, crop_mode, dimensions)
+        expected = np.clip(
+            np.abs(reference_crop(image.image, crop_mode, dimensions)), 0, 225
+        )
+        np.testing.assert_allclose(output, expected, atol=1e-8)
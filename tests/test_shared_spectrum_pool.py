@@ -0,0 +1,118 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from model.Gallery import Gallery
+from model.Image import Image
+from model.Mixer import MixCancelled, Mixer
+from model.SharedSpectrumPool import SharedSpectrumPool
+
+SHAPE = (96, 130)
+TYPES = {
+    "magnitude/phase": ["magnitude", "phase", "phase", "magnitude"],
+    "real/imaginary": ["real", "imaginary", "imaginary", "real"],
+}
+WEIGHTS = [0.5, 1, 0.3, 0.8]
+
+
+def make_image(shape, seed):
+    image = Image()
+    image.set_image(np.random.default_rng(seed).random(shape) * 255)
+    image.compute_fourier_transform()
+    return image
+
+
+def make_gallery(shape):
+    gallery = Gallery()
+    for image_id in range(4):
+        gallery.add_image(make_image(shape, image_id), image_id)
+    return gallery
+
+
+def is_unlinked(name):
+    try:
+        shared_memory.SharedMemory(name=name).close()
+    except FileNotFoundError:
+        return True
+    return False
+
+
+def wait_until(condition, timeout=5):
+    # Blocks are released by the done callbacks of the futures, just after their results
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = SharedSpectrumPool(1)
+    yield pool
+    pool.close()
+
+
+@pytest.mark.parametrize("types", TYPES.values(), ids=TYPES.keys())
+@pytest.mark.parametrize("crop_mode, dimensions", [(0, None), (1, [40, 90, 30, 70])])
+def test_pool_mix_matches_in_process_mix(pool, types, crop_mode, dimensions):
+    gallery = make_gallery(SHAPE)
+    pool.publish(gallery)
+    output = pool.mix(gallery, WEIGHTS, types, [0, 1, 2, 3], crop_mode, dimensions)
+
+    expected = Mixer(WEIGHTS, types, 0, 1, 2, 3).inverse_fft(
+        make_gallery(SHAPE), crop_mode, dimensions
+    )
+    np.testing.assert_allclose(output, expected, atol=1e-9)
+
+
+def test_cancelled_mix_releases_its_result_block():
+    # A new pool, whose worker process starts long after the mix is cancelled
+    pool = SharedSpectrumPool(1)
+    try:
+        gallery = make_gallery(SHAPE)
+        handle = pool.submit(gallery, WEIGHTS, TYPES["magnitude/phase"], [0, 1, 2, 3])
+        # Checked by the worker before its first stage
+        handle.cancel()
+        name = handle.block.name
+        with pytest.raises(MixCancelled):
+            handle.result()
+        assert handle.block is None
+        assert is_unlinked(name)
+    finally:
+        pool.close()
+
+
+def test_replaced_spectrum_outlives_queued_mixes():
+    # A new pool, so the mixes are still queued when the image is replaced
+    pool = SharedSpectrumPool(1)
+    try:
+        gallery = make_gallery(SHAPE)
+        types = TYPES["real/imaginary"]
+        expected = Mixer(WEIGHTS, types, 0, 1, 2, 3).inverse_fft(make_gallery(SHAPE))
+        pool.publish(gallery)
+        old_name = pool.blocks[0].name
+
+        handles = [pool.submit(gallery, WEIGHTS, types, [0, 1, 2, 3]) for _ in range(3)]
+        gallery.add_image(make_image(SHAPE, 10), 0)
+        pool.publish(gallery)
+        assert not is_unlinked(old_name)
+
+        for handle in handles:
+            np.testing.assert_allclose(handle.result(), expected, atol=1e-9)
+        assert wait_until(lambda: is_unlinked(old_name))
+        assert not pool.retired and not pool.users
+    finally:
+        pool.close()
+
+
+def test_close_unlinks_every_block():
+    pool = SharedSpectrumPool(1)
+    gallery = make_gallery(SHAPE)
+    pool.publish(gallery)
+    names = [block.name for block in pool.blocks.values()]
+    pool.mix(gallery, WEIGHTS, TYPES["magnitude/phase"], [0, 1, 2, 3])
+    pool.close()
+    assert all(is_unlinked(name) for name in names)
+    assert not pool.blocks
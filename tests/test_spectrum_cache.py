@@ -0,0 +1,52 @@
+import numpy as np
+
+from model.SpectrumCache import SpectrumCache
+
+
+def make_entry(index, size=1000):
+    # A complex128 spectrum of size * 16 bytes
+    key = SpectrumCache.make_key(f"hash{index}", (size, 1), np.complex128)
+    return key, np.full(size, index, dtype=np.complex128)
+
+
+def test_lru_eviction_within_budget():
+    cache = SpectrumCache(max_bytes=3 * 16000)
+    entries = [make_entry(index) for index in range(4)]
+    for key, spectrum in entries[:3]:
+        cache.put(key, spectrum)
+    assert cache.size == 3 * 16000
+
+    # Reading the oldest entry makes the second one the least recently used
+    assert cache.get(entries[0][0]) is entries[0][1]
+    cache.put(*entries[3])
+    assert cache.size <= cache.max_bytes
+    assert cache.get(entries[1][0]) is None
+    for key, spectrum in (entries[0], entries[2], entries[3]):
+        assert cache.get(key) is spectrum
+    assert (cache.hits, cache.misses) == (4, 1)
+
+
+def test_budget_changes_and_oversized_entries():
+    cache = SpectrumCache(max_bytes=3 * 16000)
+    entries = [make_entry(index) for index in range(3)]
+    for key, spectrum in entries:
+        cache.put(key, spectrum)
+    assert not entries[0][1].flags.writeable
+
+    cache.set_max_bytes(16000)
+    assert cache.size == 16000
+    assert list(cache.entries) == [entries[2][0]]
+
+    # An entry larger than the whole budget is not cached and evicts nothing
+    key, spectrum = make_entry(9, size=2000)
+    cache.put(key, spectrum)
+    assert cache.get(key) is None
+    assert cache.get(entries[2][0]) is entries[2][1]
+
+
+def test_same_content_reinserted_keeps_size():
+    cache = SpectrumCache(max_bytes=10 * 16000)
+    key, spectrum = make_entry(0)
+    cache.put(key, spectrum)
+    cache.put(key, spectrum.copy())
+    assert cache.size == 16000 and len(cache.entries) == 1
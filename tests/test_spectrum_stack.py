@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+from model import RegionMask, Spectrum
+from model.Gallery import Gallery
+from model.Image import Image
+from model.Mixer import Mixer
+from model.SpectrumStack import REFRESH_UPDATES, SpectrumStack
+
+SHAPE = (36, 45)
+MODES = [("magnitude", "phase"), ("real", "imaginary")]
+CROPS = [(0, None), (1, [8, 30, 6, 20]), (2, [8, 30, 6, 20]), (1, [0, 12, 20, 35])]
+
+
+def make_gallery(shape, seed):
+    rng = np.random.default_rng(seed)
+    gallery = Gallery()
+    for image_id in range(4):
+        image = Image()
+        image.set_image(rng.random(shape) * 255)
+        image.compute_fourier_transform()
+        gallery.add_image(image, image_id)
+    return gallery
+
+
+def fresh_mix(gallery, weights, types, crop_mode, dimensions):
+    # A new stack has no cached sums, remix or inverses
+    images = gallery.get_gallery()
+    stack = SpectrumStack(
+        [images[image_id].get_fft() for image_id in range(4)], range(4), SHAPE
+    )
+    mixer = Mixer(weights, types, 0, 1, 2, 3)
+    return mixer.inverse_fft(stack, crop_mode, dimensions)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_random_edits_match_fresh_mixes(seed):
+    rng = np.random.default_rng(seed)
+    gallery = make_gallery(SHAPE, seed)
+    components = MODES[0]
+    weights = list(rng.random(4))
+    types = [components[i % 2] for i in range(4)]
+    crop_mode, dimensions = CROPS[0]
+
+    # More edits than REFRESH_UPDATES, so cached sums are both updated and refreshed
+    for step in range(10 * REFRESH_UPDATES):
+        edit = rng.integers(5)
+        if edit <= 1:
+            # Most edits move one slider, the incremental path
+            weights[rng.integers(4)] = float(rng.choice([0, 1, rng.random()]))
+        elif edit == 2:
+            types[rng.integers(4)] = components[rng.integers(2)]
+        elif edit == 3:
+            components = MODES[rng.integers(2)]
+            types = [components[rng.integers(2)] for _ in range(4)]
+        else:
+            crop_mode, dimensions = CROPS[rng.integers(len(CROPS))]
+
+        mixer = Mixer(list(weights), list(types), 0, 1, 2, 3)
+        output = mixer.inverse_fft(gallery, crop_mode, dimensions)
+        expected = fresh_mix(gallery, weights, types, crop_mode, dimensions)
+        np.testing.assert_allclose(output, expected, atol=1e-7, err_msg=f"step {step}")
+
+
+def frequency_mix(stack, weights, types, crop_mode, dimensions):
+    # The frequency-domain mix, without the image-space remix
+    mixer = Mixer(weights, types, 0, 1, 2, 3)
+    spectrum = np.empty(stack.half_shape, dtype=stack.dtype)
+    mixer.mix_spectrum(stack, mixer.choose_mode(), spectrum)
+    mask = RegionMask.get_mask(stack.shape, crop_mode, dimensions)
+    if mask is not None:
+        mask.apply(spectrum)
+    return np.clip(np.abs(Spectrum.inverse(spectrum, stack.shape)), 0, 225)
+
+
+REAL_IMAGINARY = ["real", "imaginary", "imaginary", "real"]
+# Small regions around the zero frequency, whose inverses are cheaper as partial DFTs
+BAND_SHAPE = (64, 80)
+BAND_CROPS = [(0, None), (1, [38, 42, 30, 34]), (2, [38, 42, 30, 34])]
+
+
+@pytest.mark.parametrize("crop_mode, dimensions", BAND_CROPS)
+def test_remix_matches_frequency_domain(crop_mode, dimensions):
+    gallery = make_gallery(BAND_SHAPE, 2)
+    for image in gallery.get_gallery().values():
+        image.precompute_inverses()
+    stack = gallery.get_stack()
+    mask = RegionMask.get_mask(BAND_SHAPE, crop_mode, dimensions)
+    if mask is not None:
+        assert stack.is_band_cheap(mask)
+
+    weights = [0.5, 1, 0.3, 0.8]
+    edits = [(None, None), (1, 0.2), (3, 0), (0, 1)]
+    for step, (position, weight) in enumerate(edits):
+        if position is not None:
+            weights[position] = weight
+        mixer = Mixer(list(weights), REAL_IMAGINARY, 0, 1, 2, 3)
+        output = mixer.inverse_fft(gallery, crop_mode, dimensions)
+        # Every mix was an image-space update of the last one
+        assert stack.remix[3] == step
+        expected = frequency_mix(stack, weights, REAL_IMAGINARY, crop_mode, dimensions)
+        np.testing.assert_allclose(output, expected, atol=1e-9)
+
+
+@pytest.mark.parametrize("component", ["real", "imaginary"])
+@pytest.mark.parametrize("crop_mode", [1, 2])
+def test_band_inverse_matches_masked_inverse(component, crop_mode):
+    gallery = make_gallery(BAND_SHAPE, 3)
+    stack = gallery.get_stack()
+    mask = RegionMask.get_mask(BAND_SHAPE, crop_mode, BAND_CROPS[1][1])
+    assert stack.is_band_cheap(mask)
+    stack.use_mask(mask.get_key())
+
+    for position in range(4):
+        spectrum = np.zeros(stack.half_shape, dtype=stack.dtype)
+        if component == "real":
+            spectrum.real = stack.sources[position].real
+        else:
+            spectrum.imag = stack.sources[position].imag
+        expected = Spectrum.inverse(mask.apply(spectrum), BAND_SHAPE)
+        np.testing.assert_allclose(
+            stack.get_inverse(component, position, mask), expected, atol=1e-9
+        )
+
+
+@pytest.mark.parametrize("crop_mode, dimensions", BAND_CROPS)
+def test_mapped_stack_keeps_no_inverses(tmp_path, crop_mode, dimensions):
+    gallery = make_gallery(BAND_SHAPE, 4)
+    sources = []
+    for image_id, image in gallery.get_gallery().items():
+        fft = image.get_fft()
+        mapped = np.memmap(
+            tmp_path / f"{image_id}.bin", dtype=fft.dtype, mode="w+", shape=fft.shape
+        )
+        mapped[...] = fft
+        sources.append(mapped)
+    stack = SpectrumStack(sources, range(4), BAND_SHAPE)
+
+    weights = [0.5, 1, 0.3, 0.8]
+    for position, weight in [(None, None), (1, 0.2), (2, 1)]:
+        if position is not None:
+            weights[position] = weight
+        mixer = Mixer(list(weights), REAL_IMAGINARY, 0, 1, 2, 3)
+        output = mixer.inverse_fft(stack, crop_mode, dimensions)
+        expected = frequency_mix(stack, weights, REAL_IMAGINARY, crop_mode, dimensions)
+        np.testing.assert_allclose(output, expected, atol=1e-9)
+    assert not stack.inverses and not stack.full_inverses
@@ -0,0 +1,63 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from model.SpectrumCache import SpectrumCache
+from model.SpectrumStore import SpectrumStore
+
+
+def make_spectrum(shape, dtype=np.complex128, seed=0):
+    rng = np.random.default_rng(seed)
+    half_shape = (shape[0], shape[1] // 2 + 1)
+    return (rng.random(half_shape) + 1j * rng.random(half_shape)).astype(dtype)
+
+
+def test_save_load_round_trip(tmp_path):
+    store = SpectrumStore(str(tmp_path))
+    spectrum = make_spectrum((20, 30))
+    key = SpectrumCache.make_key("abc", (20, 30), spectrum.dtype)
+    assert store.load(key) is None
+
+    saved = store.save(key, spectrum)
+    assert isinstance(saved, np.memmap)
+    np.testing.assert_array_equal(saved, spectrum)
+
+    # A new store on the same directory, as after a restart
+    loaded = SpectrumStore(str(tmp_path)).load(key)
+    assert isinstance(loaded, np.memmap) and not loaded.flags.writeable
+    np.testing.assert_array_equal(loaded, spectrum)
+    assert not [name for name in os.listdir(tmp_path) if ".tmp" in name]
+
+
+def test_key_invalidation(tmp_path):
+    store = SpectrumStore(str(tmp_path))
+    spectrum = make_spectrum((20, 30))
+    key = SpectrumCache.make_key("abc", (20, 30), spectrum.dtype)
+    store.save(key, spectrum)
+
+    assert store.load(SpectrumCache.make_key("abc", (20, 31), spectrum.dtype)) is None
+    assert store.load(SpectrumCache.make_key("abc", (20, 30), np.complex64)) is None
+    assert store.load(SpectrumCache.make_key("abd", (20, 30), spectrum.dtype)) is None
+
+    # Metadata that no longer matches its key is ignored
+    metadata_path = store.get_path(key) + ".json"
+    with open(metadata_path) as metadata_file:
+        metadata = json.load(metadata_file)
+    metadata["image_shape"] = [21, 30]
+    with open(metadata_path, "w") as metadata_file:
+        json.dump(metadata, metadata_file)
+    assert store.load(key) is None
+
+
+def test_concurrent_saves_of_the_same_key(tmp_path):
+    store = SpectrumStore(str(tmp_path))
+    spectrum = make_spectrum((64, 64))
+    key = SpectrumCache.make_key("same", (64, 64), spectrum.dtype)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        saved = list(executor.map(lambda _: store.save(key, spectrum), range(16)))
+    for stored in saved + [store.load(key)]:
+        np.testing.assert_array_equal(stored, spectrum)
+    assert not [name for name in os.listdir(tmp_path) if ".tmp" in name]
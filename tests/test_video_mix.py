@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+
+from model import Precision
+from model.Image import Image
+from model.Mixer import Mixer
+from video_mix import FrameMixer
+
+SHAPE = (48, 70)
+CASES = [
+    (["magnitude", "phase"], [0.6, 0.9], 0, None),
+    (["real", "imaginary"], [1, 0.5], 0, None),
+    (["magnitude", "phase"], [1, 1], 1, [20, 50, 10, 30]),
+    (["real", "imaginary"], [0.8, 1], 2, [5, 30, 5, 40]),
+]
+
+
+@pytest.mark.parametrize("types, weights, crop_mode, dimensions", CASES)
+def test_frame_mixer_matches_inverse_fft(types, weights, crop_mode, dimensions):
+    rng = np.random.default_rng(3)
+    mixer = Mixer(weights + [0, 0], types * 2, 0, 1, 0, 1)
+    frame_mixer = FrameMixer(mixer, 2, SHAPE, crop_mode, dimensions)
+    output = np.empty(SHAPE, dtype=np.uint8)
+
+    # The same buffers are reused for every frame tuple
+    for _ in range(3):
+        frames = (rng.random((2,) + SHAPE) * 255).astype(Precision.real_dtype())
+        images = {}
+        for image_id, frame in enumerate(frames):
+            images[image_id] = Image()
+            images[image_id].set_image(frame)
+            images[image_id].compute_fourier_transform()
+        expected = mixer.inverse_fft(images, crop_mode, dimensions)
+
+        frame_mixer.mix(frames, output)
+        difference = output.astype(int) - expected.astype(np.uint8).astype(int)
+        assert np.abs(difference).max() <= 1
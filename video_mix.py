@@ -0,0 +1,447 @@
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from batch_mix import crop_modes
+from model import Precision, RegionMask, Spectrum
+from model.Mixer import Mixer
+from model.SpectrumStack import SpectrumStack
+
+# Frames queued between the decode, mix and encode stages
+QUEUE_DEPTH = 4
+
+
+class BufferPool:
+    def __init__(self, shape, dtype, count):
+        """
+        Initialize a pool of preallocated arrays, passed from one pipeline stage to the next.
+
+        A stage takes a buffer with acquire, and the stage that no longer needs it gives it
+        back with release. Acquiring blocks while every buffer is in use, which also keeps
+        a fast stage from running ahead of a slow one.
+
+        Parameters:
+        - shape (tuple): Shape of every buffer.
+        - dtype (numpy.dtype): Type of every buffer.
+        - count (int): Number of buffers.
+        """
+        self.free = queue.Queue()
+        for _ in range(count):
+            self.free.put(np.empty(shape, dtype=dtype))
+
+    def acquire(self):
+        return self.free.get()
+
+    def release(self, buffer):
+        self.free.put(buffer)
+
+
+def open_captures(paths):
+    """
+    Open the input videos and find the frame size they are mixed at.
+
+    Parameters:
+    - paths (list): Paths of the input videos.
+
+    Returns:
+    - tuple: (list of cv2.VideoCapture, (height, width) of the smallest frames, frame rate
+              of the first video).
+    """
+    captures = []
+    for path in paths:
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise OSError(f"Could not open {path}")
+        captures.append(capture)
+
+    # Like Image.reshape_all, every frame is resized to the smallest size
+    height = min(int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)) for capture in captures)
+    width = min(int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)) for capture in captures)
+    fps = captures[0].get(cv2.CAP_PROP_FPS) or 25
+    return captures, (height, width), fps
+
+
+def read_frames(captures, shape, pool):
+    """
+    Decode one frame of every input at a time, as grayscale images of the same size.
+
+    Parameters:
+    - captures (list): The opened input videos.
+    - shape (tuple): (height, width) every frame is resized to.
+    - pool (BufferPool): Pool of float arrays of shape (number of inputs, height, width).
+
+    Yields:
+    - numpy.ndarray: Buffer from the pool holding the frame of every input, until the
+                     shortest input ends.
+    """
+    height, width = shape
+    gray = [None] * len(captures)
+    resized = np.empty(shape, dtype=np.uint8)
+    while True:
+        frames = [capture.read() for capture in captures]
+        if not all(ok for ok, _ in frames):
+            return
+
+        buffer = pool.acquire()
+        for index, (_, frame) in enumerate(frames):
+            if gray[index] is None or gray[index].shape != frame.shape[:2]:
+                gray[index] = np.empty(frame.shape[:2], dtype=np.uint8)
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray[index])
+            if gray[index].shape != shape:
+                cv2.resize(gray[index], (width, height), dst=resized)
+                np.copyto(buffer[index], resized)
+            else:
+                np.copyto(buffer[index], gray[index])
+        yield buffer
+
+
+def threaded(iterable, depth=QUEUE_DEPTH):
+    """
+    Run an iterable on its own thread, at most depth items ahead of its consumer.
+
+    Parameters:
+    - iterable (iterable): The items to produce, e.g. a generator.
+    - depth (int, optional): Number of queued items. Default is QUEUE_DEPTH.
+
+    Yields:
+    - The items of the iterable. An error raised by the iterable is raised again here.
+    """
+    items = queue.Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except BaseException as error:
+            items.put(error)
+        else:
+            items.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is done:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+class FrameMixer:
+    def __init__(self, mixer, count, shape, crop_mode=0, dimensions=None):
+        """
+        Initialize the mixer of one worker, with every array of a frame mix preallocated.
+
+        Each frame tuple is transformed into the same spectra, and mixed through the same
+        component sums, spectrum and image. The mix itself allocates no full-size array,
+        but the transforms depend on the FFT backend: the planned backend, and NumPy 2
+        for the forward transform, write straight into these arrays, while the scipy
+        backend and NumPy's inverse transform allocate their result and copy it in. The
+        frames must be in the current precision, so they are transformed without a
+        conversion. The mix is the one of Mixer.mix_spectrum and Mixer.inverse_fft,
+        computed in place; only the components with a weight are computed.
+
+        Parameters:
+        - mixer (Mixer): The mixer, over the image IDs 0 to count - 1.
+        - count (int): Number of inputs.
+        - shape (tuple): (height, width) of the frames.
+        - crop_mode (int, optional): 0 for none, 1 for inner, 2 for outer. Default is 0.
+        - dimensions (list, optional): x1,x2,y1,y2 on the centered spectrum.
+        """
+        height, width = shape
+        half_shape = (height, Spectrum.half_width(width))
+        self.shape = shape
+        self.mode = mixer.choose_mode()
+        self.mask = RegionMask.get_mask(shape, crop_mode, dimensions)
+
+        self.spectra = np.empty((count,) + half_shape, dtype=Precision.complex_dtype())
+        self.spectrum = np.empty(half_shape, dtype=Precision.complex_dtype())
+        self.sums = [
+            np.empty(half_shape, dtype=Precision.real_dtype()) for _ in range(2)
+        ]
+        self.scratch = np.empty(half_shape, dtype=Precision.real_dtype())
+        self.image = np.empty(shape, dtype=Precision.real_dtype())
+
+        # The weights are those of a Mixer over the same stack, with the same scales
+        stack = SpectrumStack(self.spectra, list(range(count)), shape)
+        components = ("magnitude", "phase") if self.mode == 2 else ("real", "imaginary")
+        scale = 2 if self.mode == 2 else 1
+        self.weights = [
+            (component, mixer.linear_weights(stack, component) * scale)
+            for component in components
+        ]
+
+    def get_component(self, component, spectrum):
+        # Written to the scratch array, so no component is allocated
+        if component == "magnitude":
+            return np.abs(spectrum, out=self.scratch)
+        if component == "phase":
+            return np.arctan2(spectrum.imag, spectrum.real, out=self.scratch)
+        if component == "real":
+            return spectrum.real
+        return spectrum.imag
+
+    def mix(self, frames, output):
+        """
+        Mix one frame tuple.
+
+        Parameters:
+        - frames (numpy.ndarray): The frame of every input, of shape (count, height, width),
+                                  in Precision.real_dtype().
+        - output (numpy.ndarray): 8-bit array the mixed frame is written to.
+
+        Returns:
+        - numpy.ndarray: The output array.
+        """
+        used = [
+            position
+            for position in range(len(self.spectra))
+            if any(weights[position] for _, weights in self.weights)
+        ]
+        for position in used:
+            Spectrum.forward(frames[position], out=self.spectra[position])
+
+        for total, (component, weights) in zip(self.sums, self.weights):
+            total.fill(0)
+            for position in used:
+                if weights[position]:
+                    value = self.get_component(component, self.spectra[position])
+                    np.multiply(value, weights[position], out=self.scratch)
+                    total += self.scratch
+
+        first, second = self.sums
+        spectrum = self.spectrum
+        if self.mode == 2:
+            np.multiply(second, 1j, out=spectrum)
+            np.exp(spectrum, out=spectrum)
+            spectrum *= first
+        else:
+            spectrum.real = first
+            spectrum.imag = second
+        if self.mask is not None:
+            self.mask.apply(spectrum)
+
+        image = Spectrum.inverse(spectrum, self.shape, out=self.image)
+        np.abs(image, out=image)
+        np.clip(image, 0, 225, out=image)
+        np.copyto(output, image, casting="unsafe")
+        return output
+
+
+def mix_frames(frames, mixer, crop_mode, dimensions, workers, frame_pool, output_pool):
+    """
+    Mix frame tuples on a thread pool, yielding the outputs in order.
+
+    The transforms release the GIL, so several frames are mixed at the same time. Each
+    worker thread mixes with its own FrameMixer, created on its first frame.
+
+    Parameters:
+    - frames (iterable): Buffers of frame tuples, given back to the pool once transformed.
+    - mixer (Mixer): The mixer, over the image IDs 0 to the number of inputs - 1.
+    - crop_mode (int): 0 for none, 1 for inner, 2 for outer.
+    - dimensions (list): x1,x2,y1,y2 on the centered spectrum, or None.
+    - workers (int): Number of frames mixed at the same time.
+    - frame_pool (BufferPool): The pool the frame buffers come from.
+    - output_pool (BufferPool): The pool the 8-bit outputs are written to.
+
+    Yields:
+    - numpy.ndarray: The mixed frames, buffers of the output pool.
+    """
+    local = threading.local()
+
+    def mix(buffer):
+        frame_mixer = getattr(local, "mixer", None)
+        if frame_mixer is None:
+            frame_mixer = local.mixer = FrameMixer(
+                mixer, len(buffer), buffer.shape[1:], crop_mode, dimensions
+            )
+        output = output_pool.acquire()
+        try:
+            frame_mixer.mix(buffer, output)
+        except BaseException:
+            output_pool.release(output)
+            raise
+        finally:
+            # The frames are no longer needed, so they can be decoded into again
+            frame_pool.release(buffer)
+        return output
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for buffer in frames:
+            pending.append(executor.submit(mix, buffer))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_frames(writer, outputs, pool):
+    # Runs on the encoding thread: writes the queued outputs until None
+    while True:
+        output = outputs.get()
+        if output is None:
+            return
+        writer.write(output)
+        pool.release(output)
+
+
+def mix_video(
+    input_paths,
+    output_path,
+    types,
+    weights,
+    crop_mode=0,
+    dimensions=None,
+    workers=None,
+    fps=None,
+    fourcc="mp4v",
+):
+    """
+    Mix videos frame by frame and encode the result.
+
+    Decoding, mixing and encoding overlap on separate threads. Decoded frames and mixed
+    frames are held in preallocated buffer pools, and each mixing thread transforms and
+    mixes into its own preallocated spectra (see FrameMixer, and for the copies some
+    FFT backends still make).
+
+    Parameters:
+    - input_paths (list): Paths of the one to four input videos.
+    - output_path (str): Path of the output video.
+    - types (list): Component used from each input ("magnitude"/"phase" or "real"/"imaginary").
+    - weights (list): Weight of each component, from 0 to 1.
+    - crop_mode (int, optional): 0 for none, 1 for inner, 2 for outer. Default is 0.
+    - dimensions (list, optional): x1,x2,y1,y2 on the centered spectrum, required when cropping.
+    - workers (int, optional): Number of frames mixed at the same time. Default is the number of CPUs.
+    - fps (float, optional): Frame rate of the output. Default is the rate of the first input.
+    - fourcc (str, optional): Four-character code of the output codec. Default is "mp4v".
+
+    Returns:
+    - int: Number of mixed frames.
+    """
+    count = len(input_paths)
+    if not 1 <= count <= 4 or len(types) != count or len(weights) != count:
+        raise ValueError("Give one to four inputs, with one type and weight for each")
+
+    # The mixer has four slots: unused slots repeat an input with a zero weight
+    slots = [slot % count for slot in range(4)]
+    mixer = Mixer(
+        [weights[slot] if slot < count else 0 for slot in range(4)],
+        [types[index] for index in slots],
+        *slots,
+    )
+    mixer.choose_mode()
+
+    workers = workers or os.cpu_count() or 1
+    captures, shape, input_fps = open_captures(input_paths)
+    height, width = shape
+    writer = cv2.VideoWriter(
+        output_path,
+        cv2.VideoWriter_fourcc(*fourcc),
+        fps or input_fps,
+        (width, height),
+        False,
+    )
+    if not writer.isOpened():
+        raise OSError(f"Could not write {output_path}")
+
+    # Enough buffers for every queued and in-flight frame, so no stage waits on another
+    # Frames are decoded in the working precision, so no transform converts them
+    frame_pool = BufferPool(
+        (count, height, width), Precision.real_dtype(), QUEUE_DEPTH + 2 * workers + 1
+    )
+    # Completed outputs wait in order, so the oldest running mix always finds a buffer
+    output_pool = BufferPool(shape, np.uint8, QUEUE_DEPTH + 2 * workers + 2)
+    outputs = queue.Queue(maxsize=QUEUE_DEPTH)
+    encoder = threading.Thread(target=write_frames, args=(writer, outputs, output_pool))
+    encoder.start()
+
+    frames = 0
+    try:
+        decoded = threaded(read_frames(captures, shape, frame_pool))
+        for output in mix_frames(
+            decoded, mixer, crop_mode, dimensions, workers, frame_pool, output_pool
+        ):
+            outputs.put(output)
+            frames += 1
+    finally:
+        outputs.put(None)
+        encoder.join()
+        writer.release()
+        for capture in captures:
+            capture.release()
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mix the frames of up to four videos, e.g. one video's magnitude with another's phase."
+    )
+    parser.add_argument("inputs", nargs="+", help="one to four input videos")
+    parser.add_argument("-o", "--output", default="mix.mp4")
+    parser.add_argument(
+        "--types",
+        nargs="+",
+        required=True,
+        help="component used from each input: magnitude/phase or real/imaginary",
+    )
+    parser.add_argument(
+        "--weights",
+        nargs="+",
+        type=float,
+        help="weight of each component, from 0 to 1 (default: 1 / number of inputs)",
+    )
+    parser.add_argument("--crop-mode", choices=list(crop_modes), default="none")
+    parser.add_argument(
+        "--roi",
+        nargs=4,
+        type=int,
+        metavar=("X1", "X2", "Y1", "Y2"),
+        help="region on the centered spectrum, required when cropping",
+    )
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--fps", type=float, default=None)
+    parser.add_argument("--fourcc", default="mp4v")
+    args = parser.parse_args()
+
+    # By default every input weighs the same, as with every GUI slider at 100%
+    weights = args.weights or [1 / len(args.inputs)] * len(args.inputs)
+    if not 1 <= len(args.inputs) <= 4:
+        parser.error("give one to four input videos")
+    if len(args.types) != len(args.inputs) or len(weights) != len(args.inputs):
+        parser.error("give one type and one weight per input video")
+    crop_mode = crop_modes[args.crop_mode]
+    if crop_mode and args.roi is None:
+        parser.error("--roi is required when cropping")
+
+    start = time.perf_counter()
+    try:
+        frames = mix_video(
+            args.inputs,
+            args.output,
+            args.types,
+            weights,
+            crop_mode,
+            args.roi if crop_mode else None,
+            args.workers,
+            args.fps,
+            args.fourcc,
+        )
+    except (OSError, ValueError) as error:
+        print(f"Could not mix: {error}", file=sys.stderr)
+        sys.exit(1)
+    seconds = time.perf_counter() - start
+    print(f"{frames} frames written to {args.output} ({frames / seconds:.1f} fps)")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,29 @@ import numpy as np
 from PyQt6 import QtCore
 import pyqtgraph as pg
 
+from view.PyramidImageView import PyramidImageView
+
+# Drag events arriving faster than this are merged into one render
+FRAME_INTERVAL_MS = 16
+
+LUT_INDICES = np.arange(256, dtype=np.float32)
+
+
+def make_brightness_contrast_lut(brightness, contrast):
+    """
+    Build the lookup table applying brightness and contrast to 8-bit pixel values.
+
+    Parameters:
+    - brightness (float): Offset added to every pixel value.
+    - contrast (float): Relative contrast, 0 leaves the contrast unchanged.
+
+    Returns:
+    - numpy.ndarray: 256 uint8 entries, the displayed value of each pixel value.
+    """
+    return np.clip((LUT_INDICES + brightness) * (1 + contrast), 0, 255.0).astype(
+        np.uint8
+    )
+
 
 class CustomViewBox(pg.ViewBox):
     def __init__(self, imageViewComponent, *args, **kwargs):
@@ -10,6 +33,10 @@ class CustomViewBox(pg.ViewBox):
         self.child = imageViewComponent
         self.currentBrightness = 0
         self.currentContrast = 0
+        self.renderTimer = QtCore.QTimer()
+        self.renderTimer.setSingleShot(True)
+        self.renderTimer.setInterval(FRAME_INTERVAL_MS)
+        self.renderTimer.timeout.connect(self.render)
 
     def mouseDragEvent(self, event, axis=None):
         if event.button() == QtCore.Qt.MouseButton.LeftButton:
@@ -22,21 +49,21 @@ class CustomViewBox(pg.ViewBox):
                 self.currentBrightness += dx
             if abs(dy) > 2:
                 self.currentContrast += dy * 0.01
-            newImage = np.clip(
-                (self.child.originalImage + self.currentBrightness)
-                * (1 + self.currentContrast),
-                0,
-                255.0,
-            )
-            self.child.setImage(newImage)
+            # Render at most once per frame, with the latest brightness and contrast
+            if not self.renderTimer.isActive():
+                self.renderTimer.start()
             event.accept()
 
+    def render(self):
+        self.child.setBrightnessContrast(self.currentBrightness, self.currentContrast)
+
     def mouseClickEvent(self, event):
         if event.button() == QtCore.Qt.MouseButton.RightButton:
             self.dragStartPos = None
             self.currentBrightness = 0
             self.currentContrast = 0
-            self.child.setImage(self.child.originalImage)
+            self.renderTimer.stop()
+            self.render()
 
     def mouseReleaseEvent(self, event):
         if event.button() == QtCore.Qt.MouseButton.LeftButton:
@@ -44,21 +71,43 @@ class CustomViewBox(pg.ViewBox):
         super(CustomViewBox, self).mouseReleaseEvent(event)
 
 
-class CustomImageView(pg.ImageView):
+class CustomImageView(PyramidImageView):
     def __init__(self, *args, **kwargs):
         kwargs["view"] = CustomViewBox(imageViewComponent=self)
         super().__init__(*args, **kwargs)
         self.imageItem = self.getImageItem()
-        self.originalImage = None
-        self.firstTime = True
+        self.displayBuffer = None
+        self.lut = make_brightness_contrast_lut(0, 0)
 
     def setImage(self, img, *args, **kwargs):
-        super().setImage(img, *args, **kwargs)
+        """
+        Show an image with fixed 0 to 255 levels.
+
+        The image is converted once to an 8-bit display buffer. Brightness and contrast
+        are then applied as a 256-entry lookup table, which pyqtgraph folds into the
+        color table of the displayed image, so dragging never touches the pixels.
+
+        Parameters:
+        - img (numpy.ndarray): The image, with values from 0 to 255.
+        """
+        self.displayBuffer = self.toDisplay(img)
+        kwargs.setdefault("autoLevels", False)
+        kwargs.setdefault("levels", (0, 255))
+        super().setImage(self.displayBuffer, *args, **kwargs)
         self.imageItem = self.getImageItem()
-        if self.firstTime:
-            self.firstTime = False
-            self.originalImage = self.getImageItem().image
+        self.imageItem.setLookupTable(self.lut)
+
+    def toDisplay(self, array):
+        if array.dtype == np.uint8:
+            return array
+        return np.clip(np.rint(array), 0, 255.0).astype(np.uint8)
+
+    def setBrightnessContrast(self, brightness, contrast):
+        if self.displayBuffer is None:
+            return
+        self.lut = make_brightness_contrast_lut(brightness, contrast)
+        self.imageItem.setLookupTable(self.lut)
 
     def __del__(self):
         self.imageItem = None
-        self.originalImage = None
+        self.displayBuffer = None
@@ -0,0 +1,75 @@
+import numpy as np
+import pyqtgraph as pg
+from PyQt6.QtCore import QRectF
+
+
+class OutputView:
+    def __init__(self, container):
+        """
+        Initialize a persistent view of mixed outputs.
+
+        The ImageView is created once, on the first output, and every later output only
+        replaces the image of its ImageItem, with fixed levels and without autoRange.
+        Outputs are converted into two 8-bit buffers used in turn: the next output is
+        written into the buffer that is not shown, then swapped in.
+
+        Parameters:
+        - container (QWidget): Widget whose layout receives the view.
+        """
+        self.container = container
+        self.view = None
+        self.buffers = {}
+        self.front = None
+        self.rect = None
+
+    def createView(self):
+        self.view = pg.ImageView(parent=self.container)
+        # Outputs are (height, width) arrays, shown without transposing them
+        self.view.getImageItem().setOpts(axisOrder="row-major")
+        self.view.ui.roiBtn.hide()
+        self.view.ui.menuBtn.hide()
+        self.view.ui.histogram.hide()
+        self.container.layout().addWidget(self.view)
+
+    def getBackBuffer(self, shape):
+        # A preview and a full-resolution output alternate, so a pair is kept per shape
+        pair = self.buffers.pop(shape, None)
+        if pair is None:
+            pair = (np.empty(shape, dtype=np.uint8), np.empty(shape, dtype=np.uint8))
+        self.buffers[shape] = pair
+        # Only the pairs of the last preview and output shapes are kept
+        for other in list(self.buffers)[:-2]:
+            del self.buffers[other]
+        return pair[1] if self.front is pair[0] else pair[0]
+
+    def show(self, output, fullShape=None):
+        """
+        Show an output in place of the current one.
+
+        Parameters:
+        - output (numpy.ndarray): The output, with values from 0 to 255.
+        - fullShape (tuple, optional): Shape of the full-resolution output. A smaller
+                                       preview is stretched over it, so the view keeps its
+                                       zoom when the full-resolution output replaces it.
+                                       Default is the shape of the output.
+
+        Returns:
+        - None
+        """
+        if self.view is None:
+            self.createView()
+
+        back = self.getBackBuffer(output.shape)
+        np.copyto(back, output, casting="unsafe")
+
+        imageItem = self.view.getImageItem()
+        imageItem.setImage(back, autoLevels=False, levels=(0, 255))
+        self.front = back
+
+        height, width = fullShape or output.shape
+        rect = QRectF(0, 0, width, height)
+        imageItem.setRect(rect)
+        if rect != self.rect:
+            # Fit the view only when the size of the output changes
+            self.rect = rect
+            self.view.getView().autoRange()
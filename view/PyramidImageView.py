@@ -0,0 +1,86 @@
+import pyqtgraph as pg
+from PyQt6.QtCore import QRectF
+
+from model import DisplayPyramid
+
+
+class PyramidImageView(pg.ImageView):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Images are (height, width) arrays, shown without transposing them
+        self.getImageItem().setOpts(axisOrder="row-major")
+        self.pyramid = None
+        self.displayLevels = {}
+        self.level = None
+        view = self.getView()
+        view.sigRangeChanged.connect(self.updateLevel)
+        view.sigResized.connect(self.updateLevel)
+
+    def toDisplay(self, array):
+        # Subclasses may convert each level once, e.g. to 8 bits
+        return array
+
+    def getDisplayLevel(self, level):
+        if level not in self.displayLevels:
+            self.displayLevels[level] = self.toDisplay(self.pyramid[level])
+        return self.displayLevels[level]
+
+    def getFullRect(self):
+        """
+        Get the rectangle of the full-resolution level, in which every level is shown.
+
+        Returns:
+        - QRectF: The rectangle, in full-resolution pixels.
+        """
+        height, width = self.pyramid[0].shape[:2]
+        return QRectF(0, 0, width, height)
+
+    def getScale(self):
+        # Full-resolution pixels per screen pixel
+        pixelWidth, pixelHeight = self.getView().viewPixelSize()
+        return max(pixelWidth, pixelHeight)
+
+    def setPyramid(self, pyramid, autoRange=True, **kwargs):
+        """
+        Show a display pyramid, starting from the level matching the view.
+
+        Every level is stretched over the full-resolution rectangle, so items such as
+        ROIs keep using full-resolution coordinates whatever level is shown.
+
+        Parameters:
+        - pyramid (list): Levels built with DisplayPyramid.build.
+        - autoRange (bool, optional): Whether to fit the view to the image. Default is True.
+        - **kwargs: Passed to setImage, e.g. levels.
+
+        Returns:
+        - None
+        """
+        self.pyramid = pyramid
+        self.displayLevels = {}
+        rect = self.getFullRect()
+        if autoRange:
+            view = self.getView()
+            scale = max(
+                rect.width() / max(view.width(), 1),
+                rect.height() / max(view.height(), 1),
+            )
+        else:
+            scale = self.getScale()
+        self.level = DisplayPyramid.select_level(pyramid, scale)
+
+        self.setImage(self.getDisplayLevel(self.level), autoRange=False, **kwargs)
+        self.getImageItem().setRect(rect)
+        if autoRange:
+            self.autoRange()
+
+    def updateLevel(self):
+        # Switch to the level matching the new zoom, keeping the image levels
+        if self.pyramid is None:
+            return
+        level = DisplayPyramid.select_level(self.pyramid, self.getScale())
+        if level == self.level:
+            return
+        self.level = level
+        imageItem = self.getImageItem()
+        imageItem.setImage(self.getDisplayLevel(level), autoLevels=False)
+        imageItem.setRect(self.getFullRect())